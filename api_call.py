@@ -1,23 +1,138 @@
-import requests
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
 import gtfs_realtime_NYCT_pb2
 import gtfs_realtime_pb2
+import threading
 import time
 
+from feed_archive import FeedRecorder
+from feed_client import fetch
+from feed_scheduler import FeedScheduler
+
+FEED_TIMEOUT = 10  # wall-clock seconds per feed poll, retries and body included, before it times out
+
+# One worker per MTA feed so a slow feed never queues behind the others
+FEED_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="feed")
+
+RECORDER = None  # FeedRecorder that every newly fetched payload is appended to
+REPLAY = None  # ReplaySource that get_base_data serves instead of the live feeds
+
+
+def start_recording(directory):
+    global RECORDER
+    RECORDER = FeedRecorder(directory)
+    return RECORDER
+
+
+def use_replay(source):
+    global REPLAY
+    REPLAY = source
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        result |= (byte & 0x7F) << shift
+        pos += 1
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def header_timestamp(content):
+    # FeedMessage.header is field 1 and is serialized first, so only that slice
+    # needs decoding to know which snapshot the payload holds
+    try:
+        if content[0] != 0x0A:
+            return None
+        length, start = _read_varint(content, 1)
+        header = gtfs_realtime_pb2.FeedHeader()
+        header.ParseFromString(content[start : start + length])
+        return header.timestamp
+    except Exception:
+        return None
+
+
+# Returns (feed, latency). `feed` is None when the endpoint has not published a
+# new snapshot since the one recorded in `state`, so callers can skip it entirely.
+def get_feed(api_endpoint, timeout=FEED_TIMEOUT, state=None):
+    state = {} if state is None else state
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+
+    response, latency = fetch(
+        api_endpoint, deadline=time.monotonic() + timeout, headers=headers
+    )
+    if response.status_code == 304:
+        return None, latency
+
+    content = response.content
+    content_hash = hashlib.blake2b(content, digest_size=16).digest()
+    if content_hash == state.get("content_hash"):
+        return None, latency
+    # Validators are only stored once the payload is known good, so a truncated
+    # or corrupt response is fetched again instead of matching as "unchanged"
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_hash": content_hash,
+    }
+
+    timestamp = header_timestamp(content)
+    if timestamp is not None and timestamp <= (state.get("header_timestamp") or 0):
+        state.update(validators)
+        return None, latency
 
-def get_feed(api_endpoint):
-    response = requests.get(api_endpoint)
     feed = gtfs_realtime_pb2.FeedMessage()
-    feed.ParseFromString(response.content)
-    return feed
+    feed.ParseFromString(content)
+    state.update(validators)
+    state["header_timestamp"] = feed.header.timestamp
+    if RECORDER is not None:
+        RECORDER.append(state.get("feed", api_endpoint), feed.header.timestamp, content)
+    return feed, latency
 
 
 # %%
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(endpoints):
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FeedScheduler(
+                endpoints, get_feed, FEED_EXECUTOR, FEED_TIMEOUT
+            ).start()
+    return _scheduler
+
+
+def replay_pending():
+    # An as-fast-as-possible replay with snapshots left can be polled right away
+    return REPLAY is not None and REPLAY.speed is None and not REPLAY.exhausted
+
+
+# Never waits on the network: returns the feeds the background scheduler has
+# completed since this caller's previous call (tracked in last_updated["seen"]).
+# Per-feed cadence, skew and missed-update counts land in last_updated["feed_status"].
+# With a replay source installed the recorded feeds are served instead.
 def get_base_data(endpoints, last_updated):
-    while last_updated["last_updated"] is not None and last_updated[
-        "last_updated"
-    ] > datetime.now() - timedelta(seconds=25):
-        print("Sleeping")
-        time.sleep(1)
+    if REPLAY is not None:
+        last_updated["last_updated"] = datetime.now()
+        last_updated["replay_clock"] = REPLAY.clock()
+        return REPLAY.poll()
+    scheduler = start_scheduler(endpoints)
+    seen = last_updated.setdefault("seen", {})
+    feeds = {}
+    for name, (version, feed) in scheduler.snapshot().items():
+        if version > seen.get(name, 0):
+            feeds[name] = feed
+            seen[name] = version
     last_updated["last_updated"] = datetime.now()
-    return {k: get_feed(v) for k, v in endpoints.items()}
+    last_updated["feed_status"] = scheduler.feed_stats()
+    return feeds
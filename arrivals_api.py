@@ -0,0 +1,82 @@
+import hashlib
+import json
+import time
+
+from flask import Response, request
+
+from stop_codes import DIRECTIONS, station_complexes
+from stop_schedule import BOARD_WINDOW
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+FLAGS = {"1": True, "true": True, "yes": True, "0": False, "false": False, "no": False}
+
+
+def _json(body, status=200, headers=None):
+    return Response(json.dumps(body), status=status, mimetype="application/json", headers=headers)
+
+
+# GET /api/arrivals/<stop_id>[?limit=N&line=A,C&direction=N&window=s&complex=1]
+#
+# Next arrivals at a station (parent id such as "A02") or platform ("A02N",
+# which implies the direction), optionally across its whole station complex.
+# Answered from the latest snapshot's arrival index alone, so a request never
+# fetches feeds or touches the figure. The ETag hashes the selected arrivals:
+# a board revalidating with If-None-Match gets a bodyless 304 until they change.
+def register_arrivals_api(server, ingest_worker, codes, clock=time.time, transfers_file="transfers.txt"):
+    complexes = station_complexes(codes, transfers_file)
+
+    @server.route("/api/arrivals/<stop_id>")
+    def next_arrivals(stop_id):
+        station = codes.station_code.get(stop_id)
+        if station is None:
+            return _json({"error": f"unknown stop {stop_id}"}, 404)
+        direction = request.args.get("direction") or (
+            stop_id[-1] if stop_id != codes.station_ids[station] else None
+        )
+        try:
+            limit = min(int(request.args.get("limit", DEFAULT_LIMIT)), MAX_LIMIT)
+            window = int(request.args.get("window", BOARD_WINDOW))
+        except ValueError:
+            limit = window = None
+        if limit is None or limit < 0 or window <= 0:
+            return _json({"error": "limit must be a non-negative and window a positive integer"}, 400)
+        if direction is not None and direction not in tuple(DIRECTIONS):
+            return _json({"error": f"direction must be one of {', '.join(DIRECTIONS)}"}, 400)
+        lines = None
+        if line_ids := request.args.get("line"):
+            unknown = [l for l in line_ids.split(",") if l not in codes.route_code]
+            if unknown:
+                return _json({"error": f"unknown line {', '.join(unknown)}"}, 400)
+            lines = {codes.route_code[l] for l in line_ids.split(",")}
+        complex_flag = request.args.get("complex", "0").lower()
+        if complex_flag not in FLAGS:
+            return _json({"error": f"complex must be one of {', '.join(FLAGS)}"}, 400)
+        stations = complexes.get(station, (station,)) if FLAGS[complex_flag] else (station,)
+
+        arrivals = ingest_worker.current().arrivals.upcoming(
+            stations, clock(), lines, direction, window, limit
+        )
+        etag = hashlib.blake2b(repr((stations, arrivals)).encode(), digest_size=12).hexdigest()
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        return _json(
+            {
+                "stop_id": stop_id,
+                "stations": [codes.station_ids[s] for s in stations],
+                "arrivals": [
+                    {
+                        "arrival": arrival,
+                        "line": codes.route_ids[line],
+                        "direction": train_direction,
+                        "station": codes.station_ids[arrival_station],
+                        "trip_id": trip_id,
+                    }
+                    for arrival, trip_id, train_direction, arrival_station, line in arrivals
+                ],
+            },
+            headers=headers,
+        )
+
+    return next_arrivals
@@ -0,0 +1,254 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import polars as pl
+
+import gtfs_realtime_NYCT_pb2
+import gtfs_realtime_pb2
+from feed_archive import FeedArchive
+from feed_tables import decode_feed
+from math_calculations import haversine, haversine_expr, haversine_np
+from shape_geometry import ShapeGeometryIndex
+from stop_codes import load_stop_codes
+from stop_schedule import new_stop_schedule, stop_boards, stop_schedule_creation, stop_strings_creation
+from train_state import StopTime, TrainState
+from train_table_creation import initialize_train_table
+
+
+def timed(function, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def recorded_feed(archive_dir, feed_name=None):
+    if archive_dir is None:
+        raise SystemExit("this benchmark needs --archive")
+    archive = FeedArchive(archive_dir)
+    # Default to the feed with the most entities in its latest snapshot
+    feeds = {
+        name: archive.load(*archive.index[name][1][-1]) for name in archive.feeds()
+    }
+    if feed_name is None:
+        feed_name = max(feeds, key=lambda name: len(feeds[name].entity))
+    return feed_name, feeds[feed_name]
+
+
+def scaled_feed(feed, copies):
+    # Repeats every entity with a distinct trip_id suffix so the feed grows
+    # without changing the shape of each trip
+    scaled = gtfs_realtime_pb2.FeedMessage()
+    scaled.header.CopyFrom(feed.header)
+    for copy in range(copies):
+        for entity in feed.entity:
+            new = scaled.entity.add()
+            new.CopyFrom(entity)
+            new.id = f"{entity.id}-{copy}"
+            if new.HasField("vehicle"):
+                new.vehicle.trip.trip_id += f"-{copy}"
+            if new.HasField("trip_update"):
+                new.trip_update.trip.trip_id += f"-{copy}"
+    return scaled
+
+
+# %%
+def bench_train_table(archive_dir, feed_name=None, max_copies=8):
+    feed_name, feed = recorded_feed(archive_dir, feed_name)
+    print(f"initialize_train_table on {feed_name}")
+    print(f"{'entities':>10} {'seconds':>10} {'us/entity':>10}")
+    copies = 1
+    while copies <= max_copies:
+        data = {feed_name: scaled_feed(feed, copies)}
+        seconds = timed(
+            lambda: initialize_train_table({}, {"last_updated": None}, {}, data=data)
+        )
+        entities = len(data[feed_name].entity)
+        print(f"{entities:>10} {seconds:>10.4f} {seconds / entities * 1e6:>10.2f}")
+        copies *= 2
+
+
+def bench_decode(archive_dir, feed_name=None, max_copies=8):
+    feed_name, feed = recorded_feed(archive_dir, feed_name)
+    print(f"decode_feed on {feed_name}")
+    print(f"{'entities':>10} {'seconds':>10} {'entities/s':>12}")
+    copies = 1
+    while copies <= max_copies:
+        scaled = scaled_feed(feed, copies)
+        seconds = timed(decode_feed, scaled)
+        entities = len(scaled.entity)
+        print(f"{entities:>10} {seconds:>10.4f} {entities / seconds:>12,.0f}")
+        copies *= 2
+
+
+# Scalar haversine against the NumPy and Polars kernels, with the largest
+# disagreement between them
+def bench_haversine(archive_dir=None, feed_name=None, points=200_000):
+    rng = np.random.default_rng(0)
+    lat = 40.5 + rng.random(points) * 0.4
+    lon = -74.1 + rng.random(points) * 0.4
+    frame = pl.DataFrame({"lat": lat, "lon": lon})
+
+    scalar = np.array([haversine(lat[i - 1], lon[i - 1], lat[i], lon[i]) for i in range(1, points)])
+    vectorized = haversine_np(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    expression = frame.select(
+        haversine_expr(pl.col("lat").shift(1), pl.col("lon").shift(1), pl.col("lat"), pl.col("lon"))
+    ).to_series()[1:].to_numpy()
+
+    print(f"haversine over {points - 1:,} segments")
+    print(f"{'kernel':>10} {'seconds':>10} {'max |diff| km':>14}")
+    for name, function, result in (
+        ("scalar", lambda: [haversine(lat[i - 1], lon[i - 1], lat[i], lon[i]) for i in range(1, points)], scalar),
+        ("numpy", lambda: haversine_np(lat[:-1], lon[:-1], lat[1:], lon[1:]), vectorized),
+        (
+            "polars",
+            lambda: frame.select(
+                haversine_expr(pl.col("lat").shift(1), pl.col("lon").shift(1), pl.col("lat"), pl.col("lon"))
+            ),
+            expression,
+        ),
+    ):
+        seconds = timed(function, repeat=1 if name == "scalar" else 5)
+        print(f"{name:>10} {seconds:>10.4f} {np.abs(result - scalar).max():>14.2e}")
+
+
+def synthetic_shapes_stops(shapes=250, points=1400, stop_every=20):
+    # Random-walk polylines around Manhattan with a station every `stop_every` points
+    rng = np.random.default_rng(0)
+    station_ids = load_stop_codes().station_ids
+    n = shapes * points
+    sequence = np.tile(np.arange(points), shapes)
+    steps = rng.normal(0, 1e-4, size=(n, 2))
+    walk = steps.reshape(shapes, points, 2).cumsum(axis=1).reshape(n, 2)
+    stop_ids = [
+        station_ids[(i // stop_every) % len(station_ids)] if i % stop_every == 0 else None
+        for i in range(n)
+    ]
+    return pl.DataFrame(
+        {
+            "shape_id": np.repeat([f"S{i}" for i in range(shapes)], points),
+            "shape_pt_sequence": sequence,
+            "shape_pt_lat": 40.75 + walk[:, 0],
+            "shape_pt_lon": -73.98 + walk[:, 1],
+            "stop_id": stop_ids,
+        }
+    )
+
+
+def bench_positions(archive_dir=None, feed_name=None, trains=500):
+    started = time.perf_counter()
+    geometry = ShapeGeometryIndex(synthetic_shapes_stops(), load_stop_codes())
+    print(f"ShapeGeometryIndex over {len(geometry.track):,} points built in {time.perf_counter() - started:.3f}s")
+
+    rng = np.random.default_rng(1)
+    shape = rng.integers(0, len(geometry.shape_ids), trains)
+    start = geometry.shape_start[shape] + rng.integers(0, 1000, trains)
+    end = start + rng.integers(1, 300, trains)
+    departure = np.zeros(trains)
+    arrival = np.full(trains, 120.0)
+    api_time = rng.uniform(0, 150, trains)
+    incoming = rng.random(trains) < 0.2
+    stopped = rng.random(trains) < 0.3
+
+    seconds = timed(geometry.positions, start, end, departure, arrival, api_time, incoming, stopped, repeat=20)
+    print(f"positions for {trains} trains: {seconds * 1e3:.3f} ms")
+
+
+# Vectorized stop boards against the per-station loop over the arrival index,
+# on a synthetic fleet with `stops` predictions per train spread over an hour
+def bench_boards(archive_dir=None, feed_name=None, trains=600, stops=30):
+    codes = load_stop_codes()
+    rng = np.random.default_rng(2)
+    now = time.time()
+    stations = len(codes.station_ids)
+    trains_tracked = {
+        f"trip{i}": TrainState(
+            None,
+            None,
+            None,
+            None,
+            tuple(
+                StopTime(int(station) << 1, int(now + offset), int(now + offset))
+                for station, offset in zip(
+                    rng.choice(stations, stops, replace=False), rng.integers(-600, 3600, stops)
+                )
+            ),
+            2,
+            int(now),
+            "N",
+            int(rng.integers(0, len(codes.route_ids))),
+        )
+        for i in range(trains)
+    }
+    index = stop_schedule_creation(trains_tracked, new_stop_schedule())
+    index.expire(now)
+    print(f"stop boards for {trains} trains, {trains * stops:,} predictions")
+    for name, function in (
+        ("index loop", lambda: stop_strings_creation(index, codes, now)),
+        ("vectorized", lambda: stop_boards(trains_tracked, codes, now)),
+    ):
+        print(f"{name:>12} {timed(function) * 1e3:>8.2f} ms")
+
+
+# Each static load runs in a fresh interpreter so ru_maxrss (KiB on Linux) is its
+# own peak; reads the GTFS files in the working directory
+STATIC_LOAD = """
+import resource, time
+import polars as pl
+import cleaning
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.perf_counter()
+{load}
+print(time.perf_counter() - started, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base)
+"""
+STATIC_LOADERS = {
+    "eager reads": "cleaning.color_file(), cleaning.shapes_file(), cleaning.stops_file()",
+    "lazy collect": (
+        "pl.collect_all([cleaning.shapes_scan(), cleaning.stops_scan(), cleaning.color_scan()],"
+        " engine='streaming')"
+    ),
+    "shapes_stops_colors": "cleaning.shapes_stops_colors()",
+}
+
+
+def bench_static_load(archive_dir=None, feed_name=None, repeat=3):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    print(f"{'load':>20} {'seconds':>10} {'peak MiB':>10}")
+    for name, load in STATIC_LOADERS.items():
+        runs = [
+            subprocess.run(
+                [sys.executable, "-c", STATIC_LOAD.format(load=load)],
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.split()
+            for _ in range(repeat)
+        ]
+        seconds = min(float(run[0]) for run in runs)
+        peak = max(int(run[1]) for run in runs) / 1024
+        print(f"{name:>20} {seconds:>10.3f} {peak:>10.1f}")
+
+
+BENCHMARKS = {
+    "train_table": bench_train_table,
+    "decode": bench_decode,
+    "haversine": bench_haversine,
+    "positions": bench_positions,
+    "static_load": bench_static_load,
+    "boards": bench_boards,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks against recorded feeds")
+    parser.add_argument("benchmark", choices=BENCHMARKS)
+    parser.add_argument("--archive", help="directory written by main.py --record")
+    parser.add_argument("--feed", help="feed name, defaults to the largest recorded feed")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.archive, args.feed)
@@ -1,91 +1,105 @@
+import functools
 import polars as pl
 from polars import col
 import re
 
+from spatial_index import SNAP_TOLERANCE, snap_stops_to_shapes
+
 
 ## Color cleaning
 # %%
-def color_file():
-    colors = pl.read_csv("MTA_Colors_20240623.csv", separator=",", has_header=True)
+# Lazy scans below only read the columns and rows their consumers use; the
+# *_file functions collect them for callers that want frames.
+def color_scan():
+    colors = pl.scan_csv("MTA_Colors_20240623.csv", separator=",", has_header=True)
     colors = colors.filter(col("Operator") == "New York City Subway")
     colors = colors.with_columns(
         col("Service").str.split(",")
     )  # Split the comma-delimited values into lists
-    colors = colors.explode("Service")  # Explode the lists into separate rows
-    # %%
+    return colors.explode("Service")  # Explode the lists into separate rows
+
+
+def color_lookup_dict(colors):
     color_lookup = colors.select(["Service", "Hex color"]).to_dict(as_series=False)
-    color_lookup = {x: y for (x, y) in zip(*color_lookup.values())}
-    return colors, color_lookup
+    return {x: y for (x, y) in zip(*color_lookup.values())}
+
+
+def color_file():
+    colors = color_scan().collect()
+    return colors, color_lookup_dict(colors)
+
+
+# "A..N55R" -> Line "A", Line_Variation "N55"
+SHAPE_UNPACK_RE = r"^(?P<Line>\w{1}).*\.+(?P<Line_Variation>\w+?)([XR]).*$"
+# "A02" -> Line "A", Order "02"
+STOP_UNPACK_RE = r"^(?P<Line>\w{1})(?P<Order>\d{2})"
 
 
 def shape_unpack(shape):
-    shape_unpack_re = re.compile(r"^(\w{1}).*\.+(\w+?)([XR]).*$")
-    m = re.match(shape_unpack_re, shape)
+    m = re.match(SHAPE_UNPACK_RE, shape)
     return m.group(1), m.group(2)
 
 
-def shapes_file():
-    shapes = pl.read_csv(
+def shapes_scan():
+    shapes = pl.scan_csv(
         "shapes.txt",
         separator=",",
         has_header=True,
     )
-    shapes_clean = shapes.with_columns(
-        [
-            shapes["shape_id"]
-            .map_elements(lambda x: shape_unpack(x)[0], return_dtype=str)
-            .alias("Line"),
-            shapes["shape_id"]
-            .map_elements(lambda x: shape_unpack(x)[1], return_dtype=str)
-            .alias("Line_Variation"),
-        ]
+    # One native regex pass for both columns, named groups become the fields
+    return (
+        shapes.with_columns(col("shape_id").str.extract_groups(SHAPE_UNPACK_RE).alias("unpacked"))
+        .with_columns(
+            col("unpacked").struct.field("Line"),
+            col("unpacked").struct.field("Line_Variation"),
+        )
+        .drop("unpacked")
     )
-    return shapes_clean
-
-
-# %% md
-## Stops Cleaning
-# %%
-def stop_direction_removal(stops):
-    stop_removal_re = r".*[NS]$"
 
-    stops = stops.filter(~stops["stop_id"].str.contains(stop_removal_re))
 
-    return stops
+def shapes_file():
+    return shapes_scan().collect()
 
 
+# %% md
+## Stops Cleaning
 # %%
-
-
 def stop_unpack(stop):
-    stop_unpack_re = re.compile(r"^(\w{1})(\d{2})")
-    m = re.match(stop_unpack_re, stop)
+    m = re.match(STOP_UNPACK_RE, stop)
     return m.group(1), m.group(2)
 
 
-def stops_file():
-    stops = pl.read_csv(
+def stops_scan():
+    stops = pl.scan_csv(
         "stops.txt",
         separator=",",
         has_header=True,
         schema_overrides={"parent_station": pl.String},
     )
-    stops = stop_direction_removal(stops)
-    stops_clean = stops[["stop_id", "stop_name", "stop_lat", "stop_lon"]].with_columns(
-        [
-            stops["stop_id"]
-            .map_elements(lambda x: stop_unpack(x)[0], return_dtype=str)
-            .alias("Line"),
-            stops["stop_id"]
-            .map_elements(lambda x: stop_unpack(x)[1], return_dtype=str)
-            .alias("Order"),
-        ]
+    # Parent stations are exactly the stop_ids without an N/S suffix, and a
+    # null check pushes down into the scan
+    stops = stops.filter(col("parent_station").is_null())
+    return (
+        stops.select(["stop_id", "stop_name", "stop_lat", "stop_lon"])
+        .with_columns(col("stop_id").str.extract_groups(STOP_UNPACK_RE).alias("unpacked"))
+        .with_columns(
+            col("unpacked").struct.field("Line"),
+            col("unpacked").struct.field("Order"),
+        )
+        .drop("unpacked")
     )
+
+
+def stop_lookup_dict(stops_clean):
     stop_lookup = stops_clean.select(
         ["stop_id", "stop_lon", "stop_lat", "stop_name"]
     ).to_dict(as_series=False)
-    stop_lookup = {x: [(y, z), n] for (x, y, z, n) in zip(*stop_lookup.values())}
-    return stops_clean, stop_lookup
+    return {x: [(y, z), n] for (x, y, z, n) in zip(*stop_lookup.values())}
+
+
+def stops_file():
+    stops_clean = stops_scan().collect()
+    return stops_clean, stop_lookup_dict(stops_clean)
 
 
 # %%
@@ -114,12 +128,13 @@ def stop_lookup_f(stop, return_data, stop_lookup):
 # %%
 
 
-def shapes_stops_colors():
-    colors, color_lookup = color_file()
-    shapes = shapes_file()
-    stops, stop_lookup = stops_file()
+# Computed once per process; the stop-to-shape association is reused by every caller
+@functools.cache
+def shapes_stops_colors(snap_tolerance=SNAP_TOLERANCE):
+    colors = color_scan().select(["Service", "Hex color"])
+    stops = stops_scan()
     stops_colors = (
-        stops.join(colors, left_on="Line", right_on="Service", how="left")
+        stops.join(colors, left_on="Line", right_on="Service", how="left", maintain_order="left")
         .with_columns(pl.col("Hex color").fill_null("#858585"))
         .select(
             [
@@ -133,11 +148,13 @@ def shapes_stops_colors():
             ]
         )
     )
-    shapes_stops = shapes.join(
-        stops.select(["stop_lon", "stop_lat", "stop_name", "stop_id"]),
-        left_on=("shape_pt_lon", "shape_pt_lat"),
-        right_on=("stop_lon", "stop_lat"),
-        how="left",
+    # Every file is read once, in a single streaming collect of all four plans
+    shapes, stops, stops_colors, colors = pl.collect_all(
+        [shapes_scan(), stops, stops_colors, colors], engine="streaming"
     )
+    stop_lookup, color_lookup = stop_lookup_dict(stops), color_lookup_dict(colors)
+    # Nearest shape vertex within snap_tolerance meters, rather than an exact
+    # float join on (lon, lat) that misses stops a few decimals off the shape
+    shapes_stops = snap_stops_to_shapes(shapes, stops, snap_tolerance)
 
     return shapes_stops, stop_lookup, color_lookup, stops_colors
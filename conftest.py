@@ -0,0 +1,83 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from stop_codes import StopCodes
+
+
+class StubFeed:
+    # Local HTTP server for feed tests. Each GET pops the next queued
+    # (status, headers, body[, trickle]), the last one is repeated once the queue
+    # runs dry; with `trickle` seconds the body is sent in 8 pieces that far
+    # apart. `requests` records the headers every GET was sent with.
+    def __init__(self):
+        self.responses = [(200, {}, b"")]
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(dict(self.headers))
+                status, headers, body, *trickle = (
+                    stub.responses.pop(0) if len(stub.responses) > 1 else stub.responses[0]
+                )
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if not trickle:
+                    self.wfile.write(body)
+                    return
+                piece = -(-len(body) // 8)
+                try:
+                    for start in range(0, len(body), piece):
+                        self.wfile.write(body[start : start + piece])
+                        self.wfile.flush()
+                        time.sleep(trickle[0])
+                except OSError:
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/feed"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def queue(self, *responses):
+        self.responses = list(responses)
+
+
+@pytest.fixture
+def stub_feed():
+    stub = StubFeed()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+# StopCodes over a few stations and routes, 168 St (A09, 112) is one complex in
+# the transfers.txt next to them
+@pytest.fixture
+def codes(tmp_path):
+    stops = tmp_path / "stops.txt"
+    stops.write_text(
+        "stop_id,stop_name,stop_lat,stop_lon,location_type,parent_station\n"
+        "A02,Inwood - 207 St,40.868072,-73.919899,1,\n"
+        "A02N,Inwood - 207 St,40.868072,-73.919899,,A02\n"
+        "A02S,Inwood - 207 St,40.868072,-73.919899,,A02\n"
+        "A03,Dyckman St,40.865491,-73.927271,1,\n"
+        "A09,168 St,40.840719,-73.939561,1,\n"
+        "112,168 St-Washington Hts,40.840556,-73.940133,1,\n"
+    )
+    routes = tmp_path / "routes.txt"
+    routes.write_text("route_id\nA\nC\n1\n")
+    (tmp_path / "transfers.txt").write_text(
+        "from_stop_id,to_stop_id,transfer_type,min_transfer_time\n"
+        "A09,112,2,180\n"
+        "112,A09,2,180\n"
+    )
+    return StopCodes(stops, routes)
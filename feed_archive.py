@@ -0,0 +1,182 @@
+import bisect
+import os
+import struct
+import threading
+import time
+import zlib
+
+import gtfs_realtime_NYCT_pb2
+import gtfs_realtime_pb2
+
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+SEGMENT_SUFFIX = ".gtfsrt.seg"
+INDEX_FILE = "index.tsv"
+# feed name length, FeedHeader.timestamp, compressed payload length
+RECORD_HEADER = struct.Struct("<HQI")
+
+
+def _segment_name(number):
+    return f"{number:06d}{SEGMENT_SUFFIX}"
+
+
+def list_segments(directory):
+    return sorted(f for f in os.listdir(directory) if f.endswith(SEGMENT_SUFFIX))
+
+
+# %%
+class FeedRecorder:
+    # Appends raw feed payloads to zlib-compressed, append-only segment files and
+    # writes one index line (feed, header timestamp, segment, offset) per record.
+
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        segments = list_segments(directory)
+        self._open_segment(segments[-1] if segments else _segment_name(0))
+        self._index = open(os.path.join(directory, INDEX_FILE), "a")
+
+    def _open_segment(self, segment):
+        self._segment = segment
+        self._file = open(os.path.join(self.directory, segment), "ab")
+
+    def append(self, feed, header_timestamp, content):
+        name = feed.encode()
+        payload = zlib.compress(content)
+        with self._lock:
+            if self._file.tell() >= self.segment_max_bytes:
+                self._file.close()
+                self._open_segment(_segment_name(int(self._segment.split(".")[0]) + 1))
+            offset = self._file.tell()
+            self._file.write(RECORD_HEADER.pack(len(name), header_timestamp, len(payload)))
+            self._file.write(name)
+            self._file.write(payload)
+            self._file.flush()
+            # The index line only goes out once its record is fully written
+            self._index.write(f"{feed}\t{header_timestamp}\t{self._segment}\t{offset}\n")
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._index.close()
+
+
+def rebuild_index(directory):
+    # Recreates index.tsv by scanning the segments, e.g. after a crash mid-write
+    with open(os.path.join(directory, INDEX_FILE), "w") as index:
+        for segment in list_segments(directory):
+            with open(os.path.join(directory, segment), "rb") as f:
+                while header := f.read(RECORD_HEADER.size):
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    offset = f.tell() - RECORD_HEADER.size
+                    name_length, header_timestamp, payload_length = RECORD_HEADER.unpack(header)
+                    feed = f.read(name_length).decode()
+                    if len(f.read(payload_length)) < payload_length:
+                        break
+                    index.write(f"{feed}\t{header_timestamp}\t{segment}\t{offset}\n")
+
+
+# %%
+class FeedArchive:
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+        self._lock = threading.Lock()
+        # feed -> (sorted header timestamps, matching (segment, offset) locations)
+        self.index = {}
+        entries = []
+        with open(os.path.join(directory, INDEX_FILE)) as index:
+            for line in index:
+                feed, header_timestamp, segment, offset = line.rstrip("\n").split("\t")
+                entries.append((int(header_timestamp), feed, segment, int(offset)))
+        for header_timestamp, feed, segment, offset in sorted(entries):
+            timestamps, locations = self.index.setdefault(feed, ([], []))
+            timestamps.append(header_timestamp)
+            locations.append((segment, offset))
+
+    def feeds(self):
+        return list(self.index)
+
+    def entries(self, start=None, end=None):
+        # (header timestamp, feed, segment, offset) for every record, in time order
+        entries = [
+            (header_timestamp, feed, *location)
+            for feed, (timestamps, locations) in self.index.items()
+            for header_timestamp, location in zip(timestamps, locations)
+            if (start is None or header_timestamp >= start)
+            and (end is None or header_timestamp <= end)
+        ]
+        return sorted(entries)
+
+    def seek(self, feed, timestamp):
+        # Latest record of `feed` published at or before `timestamp`
+        timestamps, locations = self.index[feed]
+        i = bisect.bisect_right(timestamps, timestamp) - 1
+        if i < 0:
+            return None
+        return timestamps[i], locations[i]
+
+    def read(self, segment, offset):
+        with self._lock:
+            if segment not in self._files:
+                self._files[segment] = open(os.path.join(self.directory, segment), "rb")
+            f = self._files[segment]
+            f.seek(offset)
+            name_length, header_timestamp, payload_length = RECORD_HEADER.unpack(
+                f.read(RECORD_HEADER.size)
+            )
+            feed = f.read(name_length).decode()
+            payload = f.read(payload_length)
+        return feed, header_timestamp, zlib.decompress(payload)
+
+    def load(self, segment, offset):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(self.read(segment, offset)[2])
+        return feed
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+
+# %%
+class ReplaySource:
+    # Serves recorded feeds in header-timestamp order. `speed` scales the archive
+    # clock against wall time (1.0 = real time, 10 = ten times faster); with
+    # speed=None every poll jumps straight to the next recorded snapshot.
+
+    def __init__(self, archive, speed=1.0, start=None, end=None):
+        self.archive = archive
+        self.speed = speed
+        self.entries = archive.entries(start, end)
+        self.position = 0
+        self._started = None
+
+    @property
+    def exhausted(self):
+        return self.position >= len(self.entries)
+
+    def clock(self):
+        if self.exhausted:
+            return self.entries[-1][0] if self.entries else None
+        if self.speed is None:
+            return self.entries[self.position][0]
+        if self._started is None:
+            self._started = time.monotonic()
+        return self.entries[0][0] + (time.monotonic() - self._started) * self.speed
+
+    def poll(self):
+        if self.exhausted:
+            return {}
+        now = self.clock()
+        latest = {}
+        while not self.exhausted and self.entries[self.position][0] <= now:
+            _, feed, segment, offset = self.entries[self.position]
+            latest[feed] = (segment, offset)
+            self.position += 1
+        return {feed: self.archive.load(*location) for feed, location in latest.items()}
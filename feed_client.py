@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError, SSLError
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5  # seconds, doubled on every retry
+BACKOFF_CAP = 8
+BREAKER_THRESHOLD = 5  # consecutive failed fetches before an endpoint is skipped
+BREAKER_COOLDOWN = 60  # seconds an open breaker waits before letting a probe through
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+CHUNK_SIZE = 64 * 1024
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def create_session(pool_size=8):
+    # One pooled, keep-alive connection per feed host/worker, retries are handled in fetch
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
+SESSION = create_session()
+
+# endpoint -> {"failures": consecutive failures, "open_until": monotonic time, "latency": seconds}
+FEED_STATS = {}
+_stats_lock = threading.Lock()
+
+
+def backoff_delay(attempt):
+    # Full jitter keeps the eight feeds from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+def _endpoint_stats(endpoint, stats):
+    with _stats_lock:
+        return stats.setdefault(endpoint, {"failures": 0, "open_until": 0.0, "latency": None})
+
+
+def _record_failure(endpoint_stats):
+    with _stats_lock:
+        endpoint_stats["failures"] += 1
+        if endpoint_stats["failures"] >= BREAKER_THRESHOLD:
+            endpoint_stats["open_until"] = time.monotonic() + BREAKER_COOLDOWN
+
+
+def _record_success(endpoint_stats, latency):
+    with _stats_lock:
+        endpoint_stats["failures"] = 0
+        endpoint_stats["open_until"] = 0.0
+        endpoint_stats["latency"] = latency
+
+
+def _read_by(response, deadline):
+    # Reads a streamed body, giving up at `deadline` however slowly bytes trickle
+    # in; the read timeout alone restarts on every chunk received. read1 returns
+    # whatever has arrived instead of blocking for a full chunk.
+    chunks = []
+    try:
+        while chunk := response.raw.read1(CHUNK_SIZE, decode_content=True):
+            chunks.append(chunk)
+            if time.monotonic() >= deadline:
+                response.close()
+                raise requests.Timeout(f"{response.url} not read by its deadline")
+    # The raw urllib3 errors, as iter_content would have translated them
+    except ReadTimeoutError as e:
+        raise requests.Timeout(e) from e
+    except (ProtocolError, SSLError) as e:
+        raise requests.ConnectionError(e) from e
+    response._content = b"".join(chunks)
+
+
+# With a `deadline` (time.monotonic()) the whole fetch, retries and body
+# included, ends by then with requests.Timeout.
+def fetch(
+    endpoint,
+    session=None,
+    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    retries=MAX_RETRIES,
+    deadline=None,
+    stats=FEED_STATS,
+    headers=None,
+):
+    session = session or SESSION
+    endpoint_stats = _endpoint_stats(endpoint, stats)
+    if endpoint_stats["open_until"] > time.monotonic():
+        raise CircuitOpenError(f"Circuit open for {endpoint}")
+
+    started = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            attempt_timeout = timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise requests.Timeout(f"{endpoint} not fetched by its deadline")
+                attempt_timeout = (
+                    tuple(min(t, remaining) for t in timeout)
+                    if isinstance(timeout, tuple)
+                    else min(timeout, remaining)
+                )
+            response = session.get(
+                endpoint, timeout=attempt_timeout, headers=headers, stream=deadline is not None
+            )
+            if response.status_code in RETRY_STATUSES:
+                raise requests.HTTPError(f"{response.status_code} from {endpoint}", response=response)
+            response.raise_for_status()
+            if deadline is not None:
+                _read_by(response, deadline)
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+            if e.response is not None:
+                e.response.close()
+            if deadline is not None and time.monotonic() >= deadline and not isinstance(e, requests.Timeout):
+                # A read cut short by the deadline surfaces as a ConnectionError
+                _record_failure(endpoint_stats)
+                raise requests.Timeout(f"{endpoint} not fetched by its deadline") from e
+            retryable = e.response is None or e.response.status_code in RETRY_STATUSES
+            delay = backoff_delay(attempt)
+            if (
+                not retryable
+                or attempt == retries
+                or (deadline is not None and time.monotonic() + delay >= deadline)
+            ):
+                _record_failure(endpoint_stats)
+                raise
+            time.sleep(delay)
+            continue
+        latency = time.perf_counter() - started
+        _record_success(endpoint_stats, latency)
+        return response, latency
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import requests
+
+DEFAULT_CADENCE = 30  # seconds between MTA snapshots until enough headers have been seen
+MIN_CADENCE = 5
+MAX_CADENCE = 120
+CADENCE_SMOOTHING = 0.3  # weight of the newest header spacing in the cadence estimate
+POLL_MARGIN = 2  # seconds after the expected publish time before polling
+RETRY_POLL = 5  # seconds before re-polling a feed that came back unchanged
+ERROR_POLL = 15
+
+
+class FeedScheduler:
+    # Polls every feed on its own cadence from a background thread. `fetch` is
+    # called as fetch(endpoint, timeout, state) and returns (feed or None, latency),
+    # i.e. api_call.get_feed, raising requests.Timeout once `timeout` seconds
+    # have passed. Readers never wait on the network: `snapshot` hands
+    # back whatever has been completed so far.
+
+    def __init__(self, endpoints, fetch, executor, timeout):
+        self.endpoints = dict(endpoints)
+        self.fetch = fetch
+        self.executor = executor
+        self.timeout = timeout
+        self.feed_state = {name: {"feed": name} for name in self.endpoints}
+        self.snapshots = {}  # name -> (version, FeedMessage)
+        self.stats = {
+            name: {
+                "status": "pending",
+                "version": 0,
+                "cadence": DEFAULT_CADENCE,
+                "skew": None,
+                "missed_updates": 0,
+                "polls": 0,
+                "unchanged_polls": 0,
+                "errors": 0,
+                "timeouts": 0,
+                "latency": None,
+                "last_header_timestamp": None,
+                "next_poll": 0.0,
+            }
+            for name in self.endpoints
+        }
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="feed-scheduler", daemon=True)
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.snapshots)
+
+    def feed_stats(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self.stats.items()}
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    name
+                    for name, stats in self.stats.items()
+                    if stats["next_poll"] <= now and name not in self._in_flight
+                ]
+                self._in_flight.update(due)
+            for name in due:
+                future = self.executor.submit(
+                    self.fetch, self.endpoints[name], self.timeout, self.feed_state[name]
+                )
+                future.add_done_callback(lambda f, name=name: self._completed(name, f))
+
+            with self._lock:
+                pending = [
+                    s["next_poll"] for n, s in self.stats.items() if n not in self._in_flight
+                ]
+            # With every feed in flight only a completion (or stop) can make one
+            # due, and both set _wake
+            wait = max(0.1, min(pending) - time.monotonic()) if pending else None
+            self._wake.wait(timeout=wait)
+            self._wake.clear()
+
+    def _completed(self, name, future):
+        now = time.monotonic()
+        with self._lock:
+            stats = self.stats[name]
+            stats["polls"] += 1
+            try:
+                feed, stats["latency"] = future.result()
+            except requests.Timeout:
+                stats["status"] = "timeout"
+                stats["timeouts"] += 1
+                stats["next_poll"] = now + ERROR_POLL
+            except Exception as e:
+                stats["status"] = f"error: {e}"
+                stats["errors"] += 1
+                stats["next_poll"] = now + ERROR_POLL
+            else:
+                if feed is None:
+                    stats["status"] = "unchanged"
+                    stats["unchanged_polls"] += 1
+                    stats["next_poll"] = now + min(RETRY_POLL, stats["cadence"])
+                else:
+                    self._learn_cadence(stats, feed.header.timestamp)
+                    stats["status"] = "ok"
+                    stats["version"] += 1
+                    self.snapshots[name] = (stats["version"], feed)
+                    until_next = feed.header.timestamp + stats["cadence"] - time.time()
+                    stats["next_poll"] = now + max(RETRY_POLL, until_next + POLL_MARGIN)
+            self._in_flight.discard(name)
+        self._wake.set()
+
+    @staticmethod
+    def _learn_cadence(stats, header_timestamp):
+        stats["skew"] = time.time() - header_timestamp
+        previous = stats["last_header_timestamp"]
+        stats["last_header_timestamp"] = header_timestamp
+        if previous is None or header_timestamp <= previous:
+            return
+        gap = header_timestamp - previous
+        cadence = stats["cadence"]
+        # A gap much longer than the usual spacing means snapshots were published
+        # that we never saw, so count them before folding the gap into the cadence
+        if gap > 1.5 * cadence:
+            published = round(gap / cadence)
+            stats["missed_updates"] += published - 1
+            gap /= published
+        cadence = (1 - CADENCE_SMOOTHING) * cadence + CADENCE_SMOOTHING * gap
+        stats["cadence"] = min(MAX_CADENCE, max(MIN_CADENCE, cadence))
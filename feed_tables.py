@@ -0,0 +1,82 @@
+import polars as pl
+
+VEHICLE_SCHEMA = {
+    "trip_id": pl.String,
+    "stop_id": pl.String,
+    "status": pl.Int8,
+    "timestamp": pl.Int64,
+}
+STOP_TIME_UPDATE_SCHEMA = {
+    "trip_id": pl.String,
+    "stop_id": pl.String,
+    "seq": pl.Int32,
+    "arrival": pl.Int64,
+    "departure": pl.Int64,
+}
+TRIP_SCHEMA = {
+    "trip_id": pl.String,
+    "route_id": pl.String,
+    "direction": pl.String,
+}
+
+
+# Flattens a FeedMessage into vehicles, stop_time_updates and trips tables in a
+# single walk over feed.entity. Like train_state.schedule_from_updates, updates
+# without a stop_id are left out and `direction` comes from the trip's first
+# remaining stop (S for an S suffix, N otherwise). `seq` is the position of the
+# update within its trip, since NYCT does not fill stop_sequence.
+def decode_feed(feed):
+    vehicles = {name: [] for name in VEHICLE_SCHEMA}
+    updates = {name: [] for name in STOP_TIME_UPDATE_SCHEMA}
+    trips = {name: [] for name in TRIP_SCHEMA}
+    for entity in feed.entity:
+        if entity.HasField("vehicle"):
+            vehicle = entity.vehicle
+            vehicles["trip_id"].append(vehicle.trip.trip_id)
+            vehicles["stop_id"].append(vehicle.stop_id)
+            vehicles["status"].append(vehicle.current_status)
+            vehicles["timestamp"].append(vehicle.timestamp)
+        if entity.HasField("trip_update"):
+            trip_update = entity.trip_update
+            trip_id = trip_update.trip.trip_id
+            direction = None
+            seq = 0
+            for update in trip_update.stop_time_update:
+                if not update.stop_id:
+                    continue
+                updates["trip_id"].append(trip_id)
+                updates["stop_id"].append(update.stop_id)
+                updates["seq"].append(seq)
+                updates["arrival"].append(update.arrival.time)
+                updates["departure"].append(update.departure.time)
+                seq += 1
+                if direction is None:
+                    direction = "S" if update.stop_id[-1] == "S" else "N"
+            trips["trip_id"].append(trip_id)
+            trips["route_id"].append(trip_update.trip.route_id)
+            trips["direction"].append(direction)
+    return {
+        "vehicles": pl.DataFrame(vehicles, schema=VEHICLE_SCHEMA),
+        "stop_time_updates": pl.DataFrame(updates, schema=STOP_TIME_UPDATE_SCHEMA),
+        "trips": pl.DataFrame(trips, schema=TRIP_SCHEMA),
+    }
+
+
+# Decodes every feed of a get_base_data result and stacks the tables, tagging
+# each row with the feed it came from
+def decode_feeds(data):
+    schemas = {
+        "vehicles": VEHICLE_SCHEMA,
+        "stop_time_updates": STOP_TIME_UPDATE_SCHEMA,
+        "trips": TRIP_SCHEMA,
+    }
+    decoded = [
+        {name: table.with_columns(pl.lit(feed_name).alias("feed")) for name, table in decode_feed(feed).items()}
+        for feed_name, feed in data.items()
+    ]
+    return {
+        name: pl.concat([tables[name] for tables in decoded])
+        if decoded
+        else pl.DataFrame(schema={**schema, "feed": pl.String})
+        for name, schema in schemas.items()
+    }
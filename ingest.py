@@ -0,0 +1,116 @@
+import threading
+import time
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+from api_call import get_base_data, replay_pending
+from stop_schedule import ArrivalIndex, new_stop_schedule, stop_boards, stop_schedule_creation
+from train_table_creation import API_ENDPOINTS, initialize_train_table
+
+INGEST_INTERVAL = 1  # seconds between checks for newly completed feeds
+
+
+class TrainSnapshot(NamedTuple):
+    version: int
+    created: float
+    clock: float  # time the boards and arrivals were cut at, the replay clock when replaying
+    trains_tracked: Mapping
+    problems_log: Mapping
+    stop_strings: Mapping
+    feed_status: Mapping
+    delta: Mapping
+    arrivals: ArrivalIndex
+
+
+EMPTY_SNAPSHOT = TrainSnapshot(
+    0,
+    0.0,
+    0.0,
+    MappingProxyType({}),
+    MappingProxyType({}),
+    MappingProxyType({}),
+    MappingProxyType({}),
+    MappingProxyType({}),
+    ArrivalIndex(),
+)
+
+
+class IngestWorker:
+    # Owns the mutable train state and is the only thread that touches it. Each
+    # cycle that brings new feed data publishes a read-only TrainSnapshot by
+    # swapping a single attribute, so readers always see one complete version.
+
+    def __init__(self, endpoints=API_ENDPOINTS, interval=INGEST_INTERVAL):
+        self.endpoints = endpoints
+        self.interval = interval
+        self.trains_tracked = {}
+        self.problems_log = {}
+        self.last_updated = {"last_updated": None}
+        self.stop_schedule = new_stop_schedule()
+        self._snapshot = EMPTY_SNAPSHOT
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ingest", daemon=True)
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def current(self):
+        return self._snapshot
+
+    def ingest_once(self):
+        data = get_base_data(self.endpoints, self.last_updated)
+        if not data:
+            return False
+        initialize_train_table(self.trains_tracked, self.last_updated, self.problems_log, data=data)
+        # Boards follow the replay clock when replaying recorded feeds
+        now = self.last_updated.get("replay_clock") or time.time()
+        stop_schedule_creation(self.trains_tracked, self.stop_schedule, self.last_updated["delta"])
+        self.stop_schedule.expire(now)
+        stop_strings = stop_boards(self.trains_tracked, now=now)
+        self._publish(stop_strings, now)
+        return True
+
+    def _publish(self, stop_strings, now):
+        delta = self.last_updated["delta"]
+        touched = delta["added"] | delta["changed"]
+        previous = self._snapshot.trains_tracked
+        # Unchanged trips keep the read-only copy from the previous snapshot
+        trains_tracked = {
+            trip_id: previous[trip_id]
+            if trip_id in previous and trip_id not in touched
+            else train.copy()
+            for trip_id, train in self.trains_tracked.items()
+        }
+        snapshot = TrainSnapshot(
+            version=self._snapshot.version + 1,
+            created=time.time(),
+            clock=now,
+            trains_tracked=MappingProxyType(trains_tracked),
+            problems_log=MappingProxyType(
+                {trip_id: MappingProxyType(dict(problem)) for trip_id, problem in self.problems_log.items()}
+            ),
+            stop_strings=MappingProxyType(dict(stop_strings)),
+            feed_status=MappingProxyType(dict(self.last_updated.get("feed_status", {}))),
+            delta=MappingProxyType(
+                {kind: frozenset(trip_ids) for kind, trip_ids in delta.items()}
+            ),
+            arrivals=self.stop_schedule.snapshot(),
+        )
+        self._snapshot = snapshot
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.ingest_once():
+                    print(f"Published snapshot {self._snapshot.version}")
+                    # Replays with speed=None publish one snapshot per cycle back to back
+                    if replay_pending():
+                        continue
+            except Exception as e:
+                print(f"Ingest error: {e}")
+            self._stop.wait(self.interval)
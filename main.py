@@ -1,13 +1,85 @@
 import plotly.graph_objects as go
-from train_table_creation import initialize_train_table
-from plotting import plot_trains, stop_info_plotting
+from ingest import IngestWorker
+from plotting import (
+    STATIONS_TRACE,
+    TRAINS_TRACE,
+    StopBoardCache,
+    add_station_trace,
+    plot_trains,
+    stop_info_plotting,
+    train_trajectories,
+    trains_trace,
+)
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
 import json
-from cleaning import shapes_stops_colors
+import argparse
+import threading
+import time
+from api_call import start_recording, use_replay
+from arrivals_api import register_arrivals_api
+from static_cache import read_indexes, read_static, static_bundle
+from feed_archive import FeedArchive, ReplaySource
+from math_calculations import INCOMING_PROPORTION
+from stop_codes import load_stop_codes
 import re
 
+ANIMATION_INTERVAL = 200  # ms between client-side position updates
+
+# Moves every train along its trajectory in the browser, mirroring
+# math_calculations.calculate_positions, so trains glide between server refreshes
+# without a round trip. The feed clock advances from `clock` at `rate` times
+# wall time since the payload was generated.
+ANIMATE_TRAINS = """
+function (n, payload, figure) {
+    if (!payload || !figure) {
+        return window.dash_clientside.no_update;
+    }
+    const now = payload.clock + (Date.now() / 1000 - payload.generated) * payload.rate;
+    function position(t) {
+        if (t.dist.length < 2) {
+            return [t.lon[0], t.lat[0]];
+        }
+        let fraction = 0;
+        if (t.incoming) {
+            fraction = payload.incoming;
+        } else if (!t.stopped) {
+            const tripTime = t.arrival - t.departure;
+            fraction = tripTime > 0 ? (now - t.departure) / tripTime : 1;
+        }
+        fraction = Math.min(Math.max(fraction, 0), 1);
+        const target = fraction * t.dist[t.dist.length - 1];
+        let i = 1;
+        while (i < t.dist.length - 1 && t.dist[i] < target) {
+            i++;
+        }
+        const segment = t.dist[i] - t.dist[i - 1];
+        const f = segment > 0 ? (target - t.dist[i - 1]) / segment : 1;
+        return [
+            t.lon[i - 1] + (t.lon[i] - t.lon[i - 1]) * f,
+            t.lat[i - 1] + (t.lat[i] - t.lat[i - 1]) * f,
+        ];
+    }
+    const data = figure.data.map(function (trace) {
+        if (trace.name !== "%s") {
+            return trace;
+        }
+        // customdata holds each point's trip_id
+        const lon = trace.lon.slice();
+        const lat = trace.lat.slice();
+        trace.customdata.forEach(function (tripId, point) {
+            const t = payload.trains[tripId];
+            if (t) {
+                [lon[point], lat[point]] = position(t);
+            }
+        });
+        return Object.assign({}, trace, {lon: lon, lat: lat});
+    });
+    return Object.assign({}, figure, {data: data});
+}
+""" % TRAINS_TRACE
+
 
 # Function to generate the initial figure
 def load_initial_figure(filename):
@@ -16,22 +88,81 @@ def load_initial_figure(filename):
     return go.Figure(fig_json)
 
 
-# Callback function to update the map
-def update_map_callback(n, fig_json, trains_tracked, last_updated, problems_log, stop_schedule, shapes_stops, color_lookup, stop_lookup):
-    fig = go.Figure(fig_json)
-    initialize_train_table(trains_tracked, last_updated, problems_log)
-    print("Initialize Done")
-    plot_trains(fig, trains_tracked, shapes_stops, color_lookup, stop_lookup)
-    stop_info_plotting(fig, trains_tracked, stop_schedule, stop_lookup)
-    return fig
+# Callback function to update the map, only reads the ingest worker's latest snapshot.
+# Stop boards are rendered into the base figure dict once per snapshot, changed
+# stations only, and the client is sent a Patch with the station hover texts
+# changed since its `board_version` and the trains as one trace. Returns
+# (patch, board version).
+def update_map_callback(
+    n, board_version, fig_json, ingest_worker, positions, shape_index, geometry, color_lookup, codes, board_cache
+):
+    snapshot = ingest_worker.current()
+    if board_cache.render(snapshot) is not None:
+        stats = board_cache.stats()
+        print(f"Stop boards: {stats['last_misses']} re-rendered, {stats['last_hits']} unchanged")
+    traces = {trace.get("name"): i for i, trace in enumerate(fig_json["data"])}
+
+    patch = dash.Patch()
+    station_hovertext = patch["data"][traces[STATIONS_TRACE]]["hovertext"]
+    for point, hovertext in board_cache.changes_since(board_version or 0).items():
+        station_hovertext[point] = hovertext
+    trace, index = plot_trains(snapshot.trains_tracked, shape_index, geometry, color_lookup, codes, positions)
+    stop_info_plotting(trace, snapshot.trains_tracked, codes, index)
+    patch["data"][traces[TRAINS_TRACE]] = trace
+    return patch, board_cache.version
+
+
+# Trajectories of the current snapshot for ANIMATE_TRAINS, with the feed clock
+# they are to be interpolated against
+def trajectory_payload(ingest_worker, trajectories, shape_index, geometry, codes, clock, rate):
+    snapshot = ingest_worker.current()
+    return {
+        "clock": clock(),
+        "rate": rate,
+        "generated": time.time(),
+        "incoming": INCOMING_PROPORTION,
+        "trains": train_trajectories(snapshot.trains_tracked, shape_index, geometry, codes, trajectories),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Real time NYC subway map")
+    parser.add_argument("--record", metavar="DIR", help="append every fetched feed to an archive in DIR")
+    parser.add_argument("--replay", metavar="DIR", help="serve feeds recorded in DIR instead of the live API")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay speed as a multiple of real time, 0 replays as fast as possible",
+    )
+    return parser.parse_args()
 
 
 # Main function to run the app
 def main():
+    args = parse_args()
+    if args.record:
+        start_recording(args.record)
+    clock, rate = time.time, 1.0
+    if args.replay:
+        replay = ReplaySource(FeedArchive(args.replay), speed=args.speed or None)
+        use_replay(replay)
+        # As-fast-as-possible replays jump between snapshots, hold trains still between them
+        clock, rate = replay.clock, args.speed or 0.0
+
     app = dash.Dash(__name__)
 
-    # Load initial figure
-    fig_json = load_initial_figure("map_plot_black.json")
+    # Static data and the shape indexes come precomputed from the bundle
+    bundle = static_bundle()
+    shapes_stops, stop_lookup, color_lookup, stops_colors = read_static(bundle)
+    codes = load_stop_codes()
+    geometry, shape_index = read_indexes(bundle, codes)
+
+    # Load initial figure, kept as a dict that stop boards are rendered into. The
+    # trains trace starts empty so refreshes can patch it in place.
+    fig_json = add_station_trace(load_initial_figure("map_plot_black.json").to_dict(), stops_colors)
+    fig_json["data"].append(trains_trace([], color_lookup))
+    board_cache = StopBoardCache(fig_json, codes)
     fig = go.Figure(fig_json)
 
     # Define layout
@@ -43,26 +174,71 @@ def main():
                 style={"width": "50vw", "height": "50vw"},
             ),
             dcc.Interval(id="interval-component", interval=60 * 1000, n_intervals=0),
+            dcc.Interval(id="animation-frame", interval=ANIMATION_INTERVAL, n_intervals=0),
+            dcc.Store(id="trajectories"),
+            # StopBoardCache version of the stop boards this client has
+            dcc.Store(id="board-version", data=0),
         ]
     )
 
-    shapes_stops, stop_lookup, color_lookup, stops_colors = shapes_stops_colors()
+    # Feed I/O and train state live in the ingest worker, callbacks only read snapshots
+    ingest_worker = IngestWorker().start()
+    # Render caches shared by every client's refresh, the threaded server may run
+    # several refreshes at once so they are only touched under render_lock
+    positions = {}
+    trajectories = {}
+    render_lock = threading.Lock()
 
-    # Initialize state variables
-    trains_tracked = {}
-    problems_log = {}
-    stop_schedule = {stop_id: [] for stop_id in list(stop_lookup.keys())}
-    last_updated = {"last_updated": None}
+    # JSON next-arrivals for station boards, served from the same snapshots
+    register_arrivals_api(app.server, ingest_worker, codes, clock)
 
-    # trains_tracked = initialize_train_table(trains_tracked, last_updated, problems_log)
+    # Feed health, how trip shapes were resolved and stop board cache hits, for monitoring
+    @app.server.route("/api/status")
+    def status():
+        snapshot = ingest_worker.current()
+        with render_lock:
+            trip_shapes = shape_index.stats()
+            stop_boards = board_cache.stats()
+        return {
+            "snapshot": snapshot.version,
+            "feeds": dict(snapshot.feed_status),
+            "trip_shapes": trip_shapes,
+            "stop_boards": stop_boards,
+        }
 
     # Define callback
     @app.callback(
-        Output("live-map", "figure"),
-        [Input("interval-component", "n_intervals")]
+        [Output("live-map", "figure"), Output("board-version", "data"), Output("trajectories", "data")],
+        [Input("interval-component", "n_intervals")],
+        [State("board-version", "data")],
+    )
+    def update_map(n, board_version):
+        with render_lock:
+            return (
+                *update_map_callback(
+                    n,
+                    board_version,
+                    fig_json,
+                    ingest_worker,
+                    positions,
+                    shape_index,
+                    geometry,
+                    color_lookup,
+                    codes,
+                    board_cache,
+                ),
+                trajectory_payload(ingest_worker, trajectories, shape_index, geometry, codes, clock, rate),
+            )
+
+    # Between server refreshes trains are moved in the browser
+    app.clientside_callback(
+        ANIMATE_TRAINS,
+        Output("live-map", "figure", allow_duplicate=True),
+        Input("animation-frame", "n_intervals"),
+        State("trajectories", "data"),
+        State("live-map", "figure"),
+        prevent_initial_call=True,
     )
-    def update_map(n):
-        return update_map_callback(n, fig_json, trains_tracked, last_updated, problems_log, stop_schedule, shapes_stops, color_lookup, stop_lookup)
 
     # Run the app
     app.run_server()
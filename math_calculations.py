@@ -1,10 +1,13 @@
 import math
+import numpy as np
 import polars as pl
-import bisect
+
+
+EARTH_RADIUS = 6371  # kilometers
 
 
 def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth radius in kilometers
+    R = EARTH_RADIUS
     dlat = math.radians(lat2 - lat1)
     dlon = math.radians(lon2 - lon1)
     a = (
@@ -18,6 +21,58 @@ def haversine(lat1, lon1, lat2, lon2):
     return distance
 
 
+# Vectorized haversine over NumPy arrays (degrees in, km out), agrees with haversine
+def haversine_np(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+# The same formula over Polars expressions, nulls in any input give a null distance
+def haversine_expr(lat1, lon1, lat2, lon2):
+    a = (
+        ((lat2 - lat1).radians() / 2).sin().pow(2)
+        + lat1.radians().cos()
+        * lat2.radians().cos()
+        * ((lon2 - lon1).radians() / 2).sin().pow(2)
+    )
+    return EARTH_RADIUS * 2 * pl.arctan2(a.sqrt(), (1 - a).sqrt())
+
+
+# Length of each polyline segment ending at every point, 0 for the first point
+def segment_lengths(lat, lon):
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    lengths = np.zeros(len(lat))
+    lengths[1:] = haversine_np(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    return lengths
+
+
+def cumulative_distance(lat, lon):
+    return np.cumsum(segment_lengths(lat, lon))
+
+
+# Points at many `fractions` (0..1) of a polyline's length in one call, returns
+# (lon, lat) arrays. Pass `cum_dist` when it is already known.
+def interpolate_along(lat, lon, fractions, cum_dist=None):
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    cum_dist = cumulative_distance(lat, lon) if cum_dist is None else cum_dist
+    targets = np.clip(np.asarray(fractions, dtype=float), 0, 1) * cum_dist[-1]
+    if len(lat) == 1:
+        return np.full(len(targets), lon[0]), np.full(len(targets), lat[0])
+    loc = np.clip(np.searchsorted(cum_dist, targets), 1, len(cum_dist) - 1)
+    segment = cum_dist[loc] - cum_dist[loc - 1]
+    fraction = np.divide(
+        targets - cum_dist[loc - 1], segment, out=np.ones_like(targets), where=segment > 0
+    )
+    return (
+        lon[loc - 1] + (lon[loc] - lon[loc - 1]) * fraction,
+        lat[loc - 1] + (lat[loc] - lat[loc - 1]) * fraction,
+    )
+
+
 def calculate_distance_within_line(df):
 
     df = df.sort("shape_pt_sequence")
@@ -30,20 +85,10 @@ def calculate_distance_within_line(df):
         ]
     )
 
-    # Apply the Haversine function to each row and add the result as a new column
     return df.with_columns(
-        [
-            pl.concat_list(["shape_pt_lat", "shape_pt_lon", "lag_lat", "lag_lon"])
-            .map_elements(
-                lambda row: (
-                    haversine(row[0], row[1], row[2], row[3])
-                    if row[2] is not None and row[3] is not None
-                    else None
-                ),
-                return_dtype=pl.Float64,
-            )
-            .alias("distance")
-        ]
+        haversine_expr(
+            pl.col("shape_pt_lat"), pl.col("shape_pt_lon"), pl.col("lag_lat"), pl.col("lag_lon")
+        ).alias("distance")
     )
 
 
@@ -53,33 +98,64 @@ def linear_distance(lon1, lat1, lon2, lat2, fraction):
     return lat, lon
 
 
-def calculate_position(api_time, departure, arrival, df: pl.DataFrame, incoming=False):
-    trip_time = arrival - departure
-    since_departure = api_time - departure
-    proportion_traveled = since_departure / trip_time
-    # TODO: Calculate proportions in case a train is skipping a stop
+INCOMING_PROPORTION = 0.9  # share of the stop-to-stop distance covered by an incoming train
 
-    loc = bisect.bisect_left(
-        (cum_sum := df["cum_sum"].fill_null(0).to_list()), proportion_traveled
-    )
 
-    temp = df[loc, :][0].to_dict(as_series=False)
+# `geometry` is a shape_geometry.ShapeGeometryIndex, `start` and `end` are the
+# point offsets of the previous and next stop. Returns (lon, lat).
+def calculate_position(api_time, departure, arrival, geometry, start, end, incoming=False):
+    cum_dist = geometry.cum_dist
     if incoming:
-        return linear_distance(
-            temp["lag_lon"][0],
-            temp["lag_lat"][0],
-            temp["shape_pt_lon"][0],
-            temp["shape_pt_lat"][0],
-            0.9,
-        )
-    elif proportion_traveled in cum_sum:
-        return df[loc, :].select(["shape_pt_lat", "shape_pt_lon"]).row(0)
+        proportion_traveled = INCOMING_PROPORTION
     else:
-        return linear_distance(
-            temp["lag_lon"][0],
-            temp["lag_lat"][0],
-            temp["shape_pt_lon"][0],
-            temp["shape_pt_lat"][0],
-            (proportion_traveled - (cum_sum[loc - 1] if loc != 1 else 0))
-            / (cum_sum[loc] - cum_sum[loc - 1]),
-        )
+        trip_time = arrival - departure
+        since_departure = api_time - departure
+        proportion_traveled = since_departure / trip_time if trip_time > 0 else 1.0
+    # TODO: Calculate proportions in case a train is skipping a stop
+    proportion_traveled = min(max(proportion_traveled, 0.0), 1.0)
+
+    target = cum_dist[start] + proportion_traveled * (cum_dist[end] - cum_dist[start])
+    loc = start + int(np.searchsorted(cum_dist[start : end + 1], target))
+    if loc <= start:
+        return float(geometry.lon[start]), float(geometry.lat[start])
+    segment = cum_dist[loc] - cum_dist[loc - 1]
+    lat, lon = linear_distance(
+        geometry.lon[loc - 1],
+        geometry.lat[loc - 1],
+        geometry.lon[loc],
+        geometry.lat[loc],
+        (target - cum_dist[loc - 1]) / segment if segment > 0 else 1.0,
+    )
+    return float(lon), float(lat)
+
+
+# Places every train in one pass. All arguments are equal-length arrays: `start`
+# and `end` are point offsets of the previous and next stop on the train's shape,
+# `incoming` and `stopped` are boolean masks. Stopped trains sit on `start`,
+# incoming ones at INCOMING_PROPORTION of the way. Returns (lon, lat) arrays.
+def calculate_positions(geometry, start, end, departure, arrival, api_time, incoming=None, stopped=None):
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    departure = np.asarray(departure, dtype=float)
+    trip_time = np.asarray(arrival, dtype=float) - departure
+    since_departure = np.asarray(api_time, dtype=float) - departure
+    proportion_traveled = np.divide(
+        since_departure, trip_time, out=np.ones_like(trip_time), where=trip_time > 0
+    )
+    if incoming is not None:
+        proportion_traveled = np.where(incoming, INCOMING_PROPORTION, proportion_traveled)
+    if stopped is not None:
+        proportion_traveled = np.where(stopped, 0.0, proportion_traveled)
+    proportion_traveled = np.clip(proportion_traveled, 0.0, 1.0)
+
+    track = geometry.track
+    target = track[start] + proportion_traveled * (track[end] - track[start])
+    loc = np.clip(np.searchsorted(track, target), start, end)
+    previous = np.maximum(loc - 1, start)
+    segment = track[loc] - track[previous]
+    fraction = np.divide(
+        target - track[previous], segment, out=np.ones_like(target), where=segment > 0
+    )
+    lon = geometry.lon[previous] + (geometry.lon[loc] - geometry.lon[previous]) * fraction
+    lat = geometry.lat[previous] + (geometry.lat[loc] - geometry.lat[previous]) * fraction
+    return lon, lat
@@ -1,143 +1,271 @@
-import re
-import polars as pl
-from cleaning import stop_lookup_f
-from math_calculations import calculate_position, calculate_distance_within_line
-import plotly.graph_objects as go
+from stop_codes import platform_station
 
-from stop_schedule import stop_strings_creation, stop_schedule_creation
 
+TRAINS_TRACE = "trains"
 
-def plot_map(
-        coordinates,
-        fig,
-        trip_id,
+
+# The whole fleet as one marker trace dict, so a refresh serializes a single
+# trace whatever the number of trains. `placed` is (trip_id, (lon, lat), line)
+# per train; customdata holds the trip ids in point order, which is how
+# ANIMATE_TRAINS and stop_info_plotting find a train's point.
+def trains_trace(placed, color_lookup, marker_size=15):
+    trip_ids, coordinates, lines = zip(*placed) if placed else ((), (), ())
+    return {
+        "type": "scattermapbox",
+        "mode": "markers+text",
+        "name": TRAINS_TRACE,
+        "lon": [lon for lon, _ in coordinates],
+        "lat": [lat for _, lat in coordinates],
+        "text": list(lines),
+        "customdata": list(trip_ids),
+        "textfont": {"color": "#ffffff"},
+        "marker": {"size": marker_size, "color": [color_lookup[line] for line in lines]},
+        "hoverinfo": "text",
+        "hovertext": [f"<b>Line {line}<b><br>{position}" for position, line in zip(coordinates, lines)],
+        "showlegend": False,
+    }
+
+
+def route_to_shape(trip_id, shape_index):
+    shape_id = shape_index.resolve(trip_id)
+    if shape_id is None:
+        return None, None
+    return shape_id, shape_id[0]
+
+
+# %%
+# Where a train sits on its shape, as (line, span, stop). `span` is the
+# (start, end, departure, arrival, api_time, incoming, stopped) row that
+# geometry.positions takes, with start == end for a train stopped at a station;
+# `stop` is the station's (lon, lat) when a stopped train's station is not on its
+# shape. Both are None for trains that cannot be placed.
+def train_span(trip_id, train, shape_index, geometry, codes):
+    shape_id, line = route_to_shape(trip_id, shape_index)
+    if shape_id is None:
+        return line, None, None
+    if train.current_status == 1:
+        start = geometry.stop_offset(shape_id, train.current_station)
+        if start is not None:
+            return line, (start, start, 0, 0, 0, False, True), None
+        return line, None, codes.coordinates(train.current_station)
+
+    # TODO: Implement beginning of trip versus mismatch of stations (symbol blinks red)
+    if train.prev_departure_station is None:
+        return line, None, None
+    arrival = next(
+        (
+            stop_time.arrival
+            for stop_time in train.current_schedule
+            if platform_station(stop_time.stop) == train.planned_next_station
+        ),
+        None,
+    )
+    start = geometry.stop_offset(shape_id, train.prev_departure_station)
+    end = geometry.stop_offset(shape_id, train.planned_next_station)
+    if arrival is None or start is None or end is None or end <= start:
+        return line, None, None
+    return (
         line,
-        color_lookup,
-        # hovertext,
-        marker_size=15,
-        marker_color="#03fca9",
-):
-    fig.add_trace(
-        go.Scattermapbox(
-            mode="markers+text",
-            name=trip_id,
-            lon=[coordinates[0]],
-            lat=[coordinates[1]],
-            text=line,
-            textfont=dict(color="#ffffff"),
-            marker={
-                "size": marker_size,
-                "color": color_lookup[line],
-                # "symbol": "triangle-up",
-            },
-            showlegend=False,
-            hoverinfo="text",
-            hovertext=f"<b>Line {line}<b><br>{coordinates}",
-        )
+        (
+            start,
+            end,
+            train.prev_departure_time,
+            arrival,
+            train.current_timestamp,
+            train.current_status == 0,
+            False,
+        ),
+        None,
     )
-    # fig.add_annotation(
-    #     go.layout.Annotation(
-    #         text=trip_id,
-    #         showarrow=False,
-    #         x=coordinates[0],
-    #         y=coordinates[1],
-    #         xref="x",
-    #         yref="y",
-    #         font=dict(size=12, color="black"),
-    #         xanchor="center",
-    #         yanchor="middle",
-    #     )
-    # )
-
-
-def route_to_shape(trip_id, shapes_stops):
-    # exact_route_to_shape = re.compile(r"^.*_(.*)$")
-    route_to_shape = re.compile(r"^.*_(.*?)([RX]).*$")
-    simple_route_to_shape = re.compile(r"^.*_(.*?\.{1,2}[NS]).*")
-    shape = route_to_shape.search(trip_id)
-    if shape:
-        train_route = shapes_stops.filter(
-            pl.col("shape_id") == shape.groups(1)[0]
-        )
-        if not train_route.is_empty():
-            return train_route, shape[0]
-    simple_shape = simple_route_to_shape.match(trip_id).groups(1)[0]
-    simple_shape_x = str(simple_shape).replace("X", "")
-    partial_shape = [
-        x
-        for x in shapes_stops["shape_id"].unique().to_list()
-        if re.search(rf".*({simple_shape}|{simple_shape_x}).*", x)
-    ][0]
-    train_route = shapes_stops.filter(pl.col("shape_id") == partial_shape)
-    return train_route, partial_shape[0]
 
 
-# %%
-def plot_trains(fig, trains_tracked, shapes_stops, color_lookup, stop_lookup):
-    for trip_id in trains_tracked.keys():
-        train_route, line = route_to_shape(trip_id, shapes_stops)
-        match trains_tracked[trip_id]["current_status"]:
-
-            case 0:
-                incoming = True
-            case 1:
-                if stop := stop_lookup_f(
-                        trains_tracked[trip_id]["current_station"], "coordinates", stop_lookup
-                ):
-                    plot_map(stop, fig, trip_id, line, color_lookup)
-                continue
+# `positions` caches each trip's computed position under its fingerprint, so only
+# trips added or changed since the previous render are recomputed. Those are
+# collected first and placed with a single geometry.positions call. Returns the
+# trains trace and trip_id -> point index in it.
+def plot_trains(trains_tracked, shape_index, geometry, color_lookup, codes, positions=None):
+    positions = {} if positions is None else positions
+    for trip_id in [t for t in positions if t not in trains_tracked]:
+        positions.pop(trip_id, None)
 
-        # TODO: Implement beginning of trip versus mismatch of stations (symbol blinks red)
-        if trains_tracked[trip_id]["prev_departure_station"] is None:
+    batch = []
+    for trip_id, train in trains_tracked.items():
+        fingerprint = train.fingerprint
+        if trip_id in positions and positions[trip_id][0] == fingerprint:
             continue
-        prev_stop = train_route.select(
-            [
-                pl.arg_where(
-                    pl.col("stop_id")
-                    == trains_tracked[trip_id]["prev_departure_station"]
-                ),
-            ]
-        )[0, 0]
-
-        next_stop = train_route.select(
-            [
-                pl.arg_where(
-                    pl.col("stop_id") == trains_tracked[trip_id]["planned_next_station"]
-                ),
-            ]
-        )[0, 0]
-        in_route = train_route[prev_stop: next_stop + 1]
-        result = in_route.group_by("Line", maintain_order=True).map_groups(
-            calculate_distance_within_line
-        )
+        line, span, stop = train_span(trip_id, train, shape_index, geometry, codes)
+        if span is not None:
+            batch.append((trip_id, fingerprint, line, *span))
+        elif stop is not None:
+            positions[trip_id] = (fingerprint, stop, line)
+        else:
+            positions.pop(trip_id, None)
+
+    if batch:
+        trip_ids, fingerprints, lines, *columns = zip(*batch)
+        lons, lats = geometry.positions(*columns)
+        for trip_id, fingerprint, line, lon, lat in zip(trip_ids, fingerprints, lines, lons, lats):
+            positions[trip_id] = (fingerprint, (float(lon), float(lat)), line)
+
+    placed = [
+        (trip_id, positions[trip_id][1], positions[trip_id][2])
+        for trip_id in trains_tracked
+        if trip_id in positions
+    ]
+    return trains_trace(placed, color_lookup), {trip_id: point for point, (trip_id, _, _) in enumerate(placed)}
+
 
-        sums = result.select(pl.col("distance").drop_nulls()).to_series().sum()
-        result = result.with_columns((result["distance"] / sums).alias("proportion"))
-        result = result.with_columns(
-            pl.col("proportion").cum_sum().round(7).alias("cum_sum")
+# Per-train trajectories for the browser to animate between feed updates: the
+# polyline from the previous to the next stop (lon, lat and km along it), the
+# departure and expected arrival times, and whether the train is stopped or
+# incoming. `trajectories` caches entries under the train's fingerprint like
+# `positions` in plot_trains.
+def train_trajectories(trains_tracked, shape_index, geometry, codes, trajectories=None):
+    trajectories = {} if trajectories is None else trajectories
+    for trip_id in [t for t in trajectories if t not in trains_tracked]:
+        trajectories.pop(trip_id, None)
+
+    for trip_id, train in trains_tracked.items():
+        if trip_id in trajectories and trajectories[trip_id][0] == train.fingerprint:
+            continue
+        line, span, stop = train_span(trip_id, train, shape_index, geometry, codes)
+        if span is not None:
+            start, end, departure, arrival, _, incoming, stopped = span
+            lon, lat, dist = geometry.segment(start, end)
+        elif stop is not None:
+            lon, lat, dist = [stop[0]], [stop[1]], [0.0]
+            departure, arrival, incoming, stopped = 0, 0, False, True
+        else:
+            trajectories.pop(trip_id, None)
+            continue
+        trajectories[trip_id] = (
+            train.fingerprint,
+            {
+                "lon": lon,
+                "lat": lat,
+                "dist": dist,
+                "departure": departure,
+                "arrival": arrival,
+                "incoming": bool(incoming),
+                "stopped": bool(stopped),
+            },
         )
-        api_time = trains_tracked[trip_id]["current_loc_info"].timestamp
-        departure = trains_tracked[trip_id]["prev_departure_time"]
-        arrival = trains_tracked[trip_id]["current_schedule"][0][0].arrival.time
-        position = calculate_position(api_time, departure, arrival, result, incoming)
-        plot_map(position, fig, trip_id, line, color_lookup)
-        # break
+    return {trip_id: trajectory for trip_id, (_, trajectory) in trajectories.items()}
 
 
-def stop_info_plotting(fig, trains_tracked, stop_schedule, stop_lookup):
-    stop_strings = stop_strings_creation(
-        stop_schedule_creation(trains_tracked, stop_schedule)
+STATIONS_TRACE = "stations"
+
+
+# Appends one marker trace with every station to the base figure dict. Its
+# hover text is the station's name until a stop board is rendered into it, and
+# customdata holds the station ids in point order.
+def add_station_trace(fig_json, stops_colors):
+    fig_json["data"].append(
+        {
+            "type": "scattermapbox",
+            "mode": "markers",
+            "name": STATIONS_TRACE,
+            "lon": stops_colors["stop_lon"].to_list(),
+            "lat": stops_colors["stop_lat"].to_list(),
+            "customdata": stops_colors["stop_id"].to_list(),
+            "hovertext": [f"<b>{name}</b>" for name in stops_colors["stop_name"].to_list()],
+            "hoverinfo": "text",
+            "marker": {"size": 6, "color": stops_colors["Hex color"].to_list()},
+            "showlegend": False,
+        }
     )
-    for stop in stop_lookup.keys():
-        try:
-            fig.update_traces(selector=dict(name=stop), text=stop_strings[str(stop)])
-        except KeyError:
-            print("Stop key error")
-            continue
-    for trip in trains_tracked.keys():
-        if next_stop := trains_tracked[trip]["planned_next_station"]:
-            fig.update_traces(
-                selector=dict(name=trip),
-                # TODOOOOOOO: None is not subscriptable, better account for stations that don't exist
-                hovertext=f"Next Stop: {stop_lookup_f(next_stop, 'name', stop_lookup)}<br>Direction: {trains_tracked[trip]['current_direction']}<br>Trip: {trip}",
-            )
+    return fig_json
+
+
+# Renders stop boards into the station trace of the base figure dict, only for
+# stations whose board changed since it was last rendered. The fingerprint is
+# the station's arrivals as the board shows them, ArrivalIndex.board at the
+# snapshot's clock, so a station re-renders when an arrival enters or leaves the
+# window or a minute label changes, and is checked before any text is touched.
+# Each snapshot is rendered once however many clients refresh from it. Every
+# render that changes something bumps `version`, and each point remembers the
+# version it last changed in, so `changes_since` gives any client exactly the
+# hover texts it has not seen yet. `hits` and `misses` are running totals of
+# boards skipped and re-rendered, `last_hits`/`last_misses` are those of the
+# latest snapshot.
+class StopBoardCache:
+    def __init__(self, fig_json, codes, trace_name=STATIONS_TRACE):
+        trace = next(t for t in fig_json["data"] if t.get("name") == trace_name)
+        self.codes = codes
+        self.hovertext = trace["hovertext"]
+        self.titles = list(self.hovertext)
+        # station code -> point, stations missing from the stop codes never get a board
+        self.point = {
+            codes.station_code[stop]: point
+            for point, stop in enumerate(trace["customdata"])
+            if stop in codes.station_code
+        }
+        self.fingerprints = {}  # station code -> board it was last rendered from
+        self.snapshot_version = None
+        self.version = 0
+        self.changed = {}  # point -> version its hover text last changed in
+        self.hits = self.misses = 0
+        self.last_hits = self.last_misses = 0
+
+    # Returns the station ids re-rendered, or None when `snapshot` already was
+    def render(self, snapshot):
+        if snapshot.version == self.snapshot_version:
+            return None
+        self.snapshot_version = snapshot.version
+        arrivals = snapshot.arrivals
+        # Stations that dropped off the boards are reset to their title
+        stations = set(self.fingerprints) | set(arrivals.stops)
+        dirty = []
+        version = self.version + 1
+        checked = 0
+        for station in stations:
+            point = self.point.get(station)
+            if point is None:
+                continue
+            checked += 1
+            board = arrivals.board(station, snapshot.clock)
+            if self.fingerprints.get(station, ()) == board:
+                continue
+            stop = self.codes.station_ids[station]
+            if board:
+                self.fingerprints[station] = board
+                self.hovertext[point] = f"{self.titles[point]}<br>{snapshot.stop_strings[stop]}"
+            else:
+                del self.fingerprints[station]
+                self.hovertext[point] = self.titles[point]
+            self.changed[point] = version
+            dirty.append(stop)
+        if dirty:
+            self.version = version
+        self.last_misses = len(dirty)
+        self.last_hits = checked - len(dirty)
+        self.hits += self.last_hits
+        self.misses += self.last_misses
+        return dirty
+
+    def changes_since(self, version):
+        # point -> hover text for every point changed after `version`
+        return {
+            point: self.hovertext[point] for point, changed in self.changed.items() if changed > version
+        }
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "snapshot": self.snapshot_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "last_hits": self.last_hits,
+            "last_misses": self.last_misses,
+            "boards": len(self.fingerprints),
+        }
+
+
+# Train hover text, written into the trains trace through plot_trains' index
+def stop_info_plotting(trace, trains_tracked, codes, index):
+    hovertext = trace["hovertext"]
+    for trip, point in index.items():
+        train = trains_tracked[trip]
+        if (next_stop := train.planned_next_station) is not None:
+            # Stations missing from stops.txt have no name and show as None
+            hovertext[point] = f"Next Stop: {codes.station_names[next_stop]}<br>Direction: {train.current_direction}<br>Trip: {trip}"
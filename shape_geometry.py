@@ -0,0 +1,88 @@
+import numpy as np
+import polars as pl
+
+from math_calculations import calculate_positions, haversine_expr
+
+
+# Load-time geometry for every shape as three tables: the points of all shapes
+# laid end to end with the along-track distance (km) from the start of each
+# point's shape, the first and last point offset of every shape, and the point
+# offset of every stop on every shape. static_cache stores them in the bundle.
+def geometry_tables(shapes_stops):
+    lat, lon = pl.col("shape_pt_lat"), pl.col("shape_pt_lon")
+    shapes = (
+        shapes_stops.select(
+            ["shape_id", "shape_pt_sequence", "shape_pt_lat", "shape_pt_lon", "stop_id"]
+        )
+        .sort(["shape_id", "shape_pt_sequence"], maintain_order=True)
+        .with_columns(
+            haversine_expr(
+                lat, lon, lat.shift(1).over("shape_id"), lon.shift(1).over("shape_id")
+            )
+            .fill_null(0)
+            .cum_sum()
+            .over("shape_id")
+            .alias("cum_dist")
+        )
+        .with_row_index("offset")
+    )
+    return {
+        "geometry_points": shapes.select(["shape_pt_lat", "shape_pt_lon", "cum_dist"]),
+        "geometry_shapes": shapes.group_by("shape_id", maintain_order=True).agg(
+            pl.col("offset").first().alias("start"), pl.col("offset").last().alias("end")
+        ),
+        "geometry_stops": shapes.filter(pl.col("stop_id").is_not_null()).select(
+            ["shape_id", "stop_id", "offset"]
+        ),
+    }
+
+
+# The tables above as contiguous arrays, with station offsets keyed by shape and
+# station code. Positioning a train is then array indexing plus one binary search.
+class ShapeGeometryIndex:
+    def __init__(self, shapes_stops, codes):
+        self._load(geometry_tables(shapes_stops), codes)
+
+    # Builds the index from geometry_tables output, e.g. read back from the bundle
+    @classmethod
+    def from_tables(cls, tables, codes):
+        index = cls.__new__(cls)
+        index._load(tables, codes)
+        return index
+
+    def _load(self, tables, codes):
+        points, bounds = tables["geometry_points"], tables["geometry_shapes"]
+        self.lat = points["shape_pt_lat"].to_numpy()
+        self.lon = points["shape_pt_lon"].to_numpy()
+        self.cum_dist = points["cum_dist"].to_numpy()
+
+        self.shape_ids = bounds["shape_id"].to_list()
+        self.shape_code = {shape_id: code for code, shape_id in enumerate(self.shape_ids)}
+        self.shape_start = bounds["start"].to_numpy()
+        self.shape_end = bounds["end"].to_numpy()
+        # cum_dist shifted so it keeps increasing across shape boundaries (with a
+        # 1 km gap between shapes), letting one searchsorted serve every train
+        shape_base = np.concatenate(([0.0], np.cumsum(self.cum_dist[self.shape_end] + 1)[:-1]))
+        self.track = self.cum_dist + np.repeat(shape_base, self.shape_end - self.shape_start + 1)
+
+        # (shape code, station code) -> offset of the station's first point on the shape
+        self.stop_offsets = {}
+        for shape_id, stop_id, offset in tables["geometry_stops"].iter_rows():
+            self.stop_offsets.setdefault((self.shape_code[shape_id], codes.station(stop_id)), offset)
+
+    def stop_offset(self, shape_id, station):
+        return self.stop_offsets.get((self.shape_code.get(shape_id), station))
+
+    # Points `start` to `end` of a shape as (lon, lat, km from `start`) lists, the
+    # polyline a client interpolates a train along
+    def segment(self, start, end, digits=6):
+        points = slice(start, end + 1)
+        return (
+            np.round(self.lon[points], digits).tolist(),
+            np.round(self.lat[points], digits).tolist(),
+            np.round(self.cum_dist[points] - self.cum_dist[start], 4).tolist(),
+        )
+
+    # (lon, lat) arrays for the whole fleet, see math_calculations.calculate_positions
+    def positions(self, start, end, departure, arrival, api_time, incoming=None, stopped=None):
+        return calculate_positions(self, start, end, departure, arrival, api_time, incoming, stopped)
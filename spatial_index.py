@@ -0,0 +1,126 @@
+import math
+
+import numpy as np
+import polars as pl
+
+EARTH_RADIUS_M = 6_371_000
+REFERENCE_LAT = 40.73  # projection latitude, the middle of the subway network
+SNAP_TOLERANCE = 25  # meters between a stop and the shape vertex it is snapped to
+
+
+# Equirectangular projection to meters around REFERENCE_LAT, accurate to well
+# under a meter at city scale
+def project(lon, lat):
+    lon = np.radians(np.asarray(lon, dtype=float))
+    lat = np.radians(np.asarray(lat, dtype=float))
+    return (
+        EARTH_RADIUS_M * lon * math.cos(math.radians(REFERENCE_LAT)),
+        EARTH_RADIUS_M * lat,
+    )
+
+
+# Uniform grid over projected points. Points are sorted by cell so each cell is a
+# contiguous slice of `order`; queries only look at the cells they overlap.
+class GridIndex:
+    def __init__(self, lon, lat, cell_size=200):
+        self.cell_size = cell_size
+        self.x, self.y = project(lon, lat)
+        cell_x = np.floor(self.x / cell_size).astype(np.int64)
+        cell_y = np.floor(self.y / cell_size).astype(np.int64)
+        self.cells = {}
+        if len(cell_x) == 0:
+            self.order = np.empty(0, dtype=np.int64)
+            return
+        span_y = int(cell_y.max() - cell_y.min()) + 1
+        keys = (cell_x - cell_x.min()) * span_y + (cell_y - cell_y.min())
+        self.order = np.argsort(keys, kind="stable")
+        _, starts, counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        first = self.order[starts]
+        for cx, cy, start, count in zip(
+            cell_x[first].tolist(), cell_y[first].tolist(), starts.tolist(), counts.tolist()
+        ):
+            self.cells[cx, cy] = (start, start + count)
+
+    def __len__(self):
+        return len(self.x)
+
+    def _candidates(self, min_x, min_y, max_x, max_y):
+        slices = [
+            self.order[start:end]
+            for cx in range(math.floor(min_x / self.cell_size), math.floor(max_x / self.cell_size) + 1)
+            for cy in range(math.floor(min_y / self.cell_size), math.floor(max_y / self.cell_size) + 1)
+            if (cell := self.cells.get((cx, cy)))
+            for start, end in (cell,)
+        ]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    # Indices of points within `radius` meters of (lon, lat), nearest first,
+    # together with their distances
+    def radius(self, lon, lat, radius):
+        x, y = project(lon, lat)
+        candidates = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        distances = np.hypot(self.x[candidates] - x, self.y[candidates] - y)
+        inside = distances <= radius
+        candidates, distances = candidates[inside], distances[inside]
+        nearest_first = np.argsort(distances, kind="stable")
+        return candidates[nearest_first], distances[nearest_first]
+
+    def bbox(self, min_lon, min_lat, max_lon, max_lat):
+        (min_x, max_x), (min_y, max_y) = project([min_lon, max_lon], [min_lat, max_lat])
+        candidates = self._candidates(min_x, min_y, max_x, max_y)
+        x, y = self.x[candidates], self.y[candidates]
+        return np.sort(candidates[(x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)])
+
+    # Nearest point within `max_distance` meters, or None
+    def nearest(self, lon, lat, max_distance):
+        candidates, distances = self.radius(lon, lat, max_distance)
+        if len(candidates) == 0:
+            return None
+        return int(candidates[0]), float(distances[0])
+
+
+def stations_index(codes, cell_size=200):
+    # Grid over every station with coordinates, returns (index, station codes)
+    stations = np.array([s for s, lon in enumerate(codes.station_lon) if lon is not None])
+    return (
+        GridIndex(
+            [codes.station_lon[s] for s in stations], [codes.station_lat[s] for s in stations], cell_size
+        ),
+        stations,
+    )
+
+
+# Attaches each stop to its nearest vertex on every shape passing within
+# `tolerance` meters, replacing the exact float join on (lon, lat). Stations
+# sharing a point (A12 and D13 at 145 St) or a few meters apart all snap, so like
+# the exact join a vertex claimed by several stops appears once per stop. Returns
+# `shapes` with stop_name and stop_id columns, null where no stop was snapped.
+def snap_stops_to_shapes(shapes, stops, tolerance=SNAP_TOLERANCE):
+    shapes = shapes.with_row_index("vertex")
+    index = GridIndex(shapes["shape_pt_lon"], shapes["shape_pt_lat"], cell_size=tolerance * 4)
+    vertices, stop_rows, distances = [], [], []
+    for row, (lon, lat) in enumerate(stops.select(["stop_lon", "stop_lat"]).iter_rows()):
+        candidates, candidate_distances = index.radius(lon, lat, tolerance)
+        vertices.append(candidates)
+        stop_rows.append(np.full(len(candidates), row))
+        distances.append(candidate_distances)
+
+    snapped = (
+        pl.DataFrame(
+            {
+                "vertex": np.concatenate(vertices).astype(np.uint32),
+                "stop_row": np.concatenate(stop_rows).astype(np.uint32),
+                "distance": np.concatenate(distances),
+            }
+        )
+        .join(shapes.select(["vertex", "shape_id"]), on="vertex")
+        .sort("distance", maintain_order=True)
+        .unique(["shape_id", "stop_row"], keep="first", maintain_order=True)
+        .join(
+            stops.select(["stop_name", "stop_id"]).with_row_index("stop_row"),
+            on="stop_row",
+        )
+        .select(["vertex", "stop_name", "stop_id"])
+        .sort("vertex", "stop_id")
+    )
+    return shapes.join(snapped, on="vertex", how="left", maintain_order="left").drop("vertex")
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import polars as pl
+
+import cleaning
+import shape_geometry
+import spatial_index
+import trip_shapes
+from cleaning import shapes_stops_colors
+from shape_geometry import ShapeGeometryIndex, geometry_tables
+from trip_shapes import TripShapeIndex, trip_shape_table
+
+CACHE_DIR = ".static_cache"
+# Bumped when the bundle layout changes
+BUNDLE_VERSION = 2
+# Inputs of the bundle, a change to any of them rebuilds it
+SOURCE_FILES = ("stops.txt", "shapes.txt", "trips.txt", "MTA_Colors_20240623.csv")
+# Code the bundle is derived by, hashed with the data so an edit to the cleaning
+# or snapping logic rebuilds it too
+CODE_FILES = tuple(
+    module.__file__ for module in (cleaning, spatial_index, shape_geometry, trip_shapes)
+) + (__file__,)
+STATIC_FILES = ("shapes_stops", "stops_colors", "stop_lookup", "color_lookup")
+INDEX_FILES = ("geometry_points", "geometry_shapes", "geometry_stops", "trip_shapes")
+BUNDLE_FILES = STATIC_FILES + INDEX_FILES
+
+
+def source_hash(files=SOURCE_FILES):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"bundle {BUNDLE_VERSION} snap {spatial_index.SNAP_TOLERANCE}\0".encode())
+    for name in (*files, *CODE_FILES):
+        digest.update(os.path.basename(name).encode() + b"\0")
+        with open(name, "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _bundle_path(directory, name):
+    return os.path.join(directory, f"{name}.arrow")
+
+
+# %%
+# Writes everything shapes_stops_colors derives, the shape geometry and the
+# trips.txt shape index as uncompressed Arrow IPC files in `directory`, which
+# polars memory-maps on read; the two lookup dicts are stored as tables
+def compile_static(directory, trips_file="trips.txt"):
+    # Bypasses the per-process cache, the sources may have changed since
+    shapes_stops, stop_lookup, color_lookup, stops_colors = shapes_stops_colors.__wrapped__()
+    geometry = geometry_tables(shapes_stops)
+    tables = {
+        **geometry,
+        "trip_shapes": trip_shape_table(geometry["geometry_shapes"]["shape_id"], trips_file),
+        "shapes_stops": shapes_stops,
+        "stops_colors": stops_colors,
+        "stop_lookup": pl.DataFrame(
+            [(stop_id, lon, lat, name) for stop_id, ((lon, lat), name) in stop_lookup.items()],
+            schema=["stop_id", "stop_lon", "stop_lat", "stop_name"],
+            orient="row",
+        ),
+        "color_lookup": pl.DataFrame(
+            {"Service": list(color_lookup), "Hex color": list(color_lookup.values())}
+        ),
+    }
+    for name, table in tables.items():
+        table.write_ipc(_bundle_path(directory, name))
+
+
+def read_static(directory):
+    tables = {name: pl.read_ipc(_bundle_path(directory, name)) for name in STATIC_FILES}
+    stop_lookup = {
+        stop_id: [(lon, lat), name]
+        for stop_id, lon, lat, name in tables["stop_lookup"].iter_rows()
+    }
+    color_lookup = dict(tables["color_lookup"].iter_rows())
+    return tables["shapes_stops"], stop_lookup, color_lookup, tables["stops_colors"]
+
+
+# (ShapeGeometryIndex, TripShapeIndex) from a compiled bundle without
+# recomputing either
+def read_indexes(directory, codes):
+    tables = {name: pl.read_ipc(_bundle_path(directory, name)) for name in INDEX_FILES}
+    geometry = ShapeGeometryIndex.from_tables(tables, codes)
+    return geometry, TripShapeIndex(geometry.shape_ids, trips=tables["trip_shapes"])
+
+
+# Directory of the compiled bundle for the current source files and code,
+# compiling it first when either has changed. Each bundle lives in a directory
+# named after the source hash; it is built in a temporary directory and renamed
+# into place, and older bundles are removed.
+def static_bundle(cache_dir=CACHE_DIR, files=SOURCE_FILES):
+    key = source_hash(files)
+    bundle = os.path.join(cache_dir, key)
+    if not os.path.isdir(bundle):
+        os.makedirs(cache_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=cache_dir, prefix=".build-")
+        try:
+            compile_static(staging)
+            os.rename(staging, bundle)
+        except OSError:
+            # Another process finished the same bundle first
+            if not os.path.isdir(bundle):
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        for stale in os.listdir(cache_dir):
+            if stale != key and not stale.startswith("."):
+                shutil.rmtree(os.path.join(cache_dir, stale), ignore_errors=True)
+    return bundle
+
@@ -0,0 +1,116 @@
+import csv
+import functools
+import threading
+
+DIRECTIONS = "NS"
+
+
+# Dense integer codes for every station and route, built once from stops.txt
+# and routes.txt. A station code indexes the station_* lists directly; a
+# platform code is station << 1 | direction bit (N = 0, S = 1), so the station
+# and direction of any directional stop_id come back with a shift and a mask.
+# Ids missing from the static files (e.g. R60 in the realtime feeds) are given
+# the next free code the first time they are seen, without coordinates.
+class StopCodes:
+    def __init__(self, stops_file="stops.txt", routes_file="routes.txt"):
+        self.station_ids = []
+        self.station_names = []
+        self.station_lat = []
+        self.station_lon = []
+        self.station_code = {}  # parent, N and S stop_id -> station code
+        self.route_ids = []
+        self.route_code = {}
+        self._lock = threading.Lock()
+
+        with open(stops_file) as f:
+            for row in csv.DictReader(f):
+                if not row["parent_station"]:
+                    self._add_station(
+                        row["stop_id"],
+                        row["stop_name"],
+                        float(row["stop_lat"]),
+                        float(row["stop_lon"]),
+                    )
+        with open(routes_file) as f:
+            for row in csv.DictReader(f):
+                self._add_route(row["route_id"])
+
+    def _add_station(self, station_id, name=None, lat=None, lon=None):
+        with self._lock:
+            if station_id in self.station_code:
+                return self.station_code[station_id]
+            code = len(self.station_ids)
+            self.station_ids.append(station_id)
+            self.station_names.append(name)
+            self.station_lat.append(lat)
+            self.station_lon.append(lon)
+            self.station_code[station_id] = code
+            for direction in DIRECTIONS:
+                self.station_code[station_id + direction] = code
+            return code
+
+    def _add_route(self, route_id):
+        with self._lock:
+            if route_id not in self.route_code:
+                self.route_code[route_id] = len(self.route_ids)
+                self.route_ids.append(route_id)
+            return self.route_code[route_id]
+
+    def station(self, stop_id):
+        # None for an empty stop_id, which the feeds send for unassigned stops
+        if not stop_id:
+            return None
+        code = self.station_code.get(stop_id)
+        if code is None:
+            code = self._add_station(stop_id[:-1] if stop_id[-1] in DIRECTIONS else stop_id)
+        return code
+
+    def platform(self, stop_id):
+        station = self.station(stop_id)
+        return None if station is None else station << 1 | (stop_id[-1] == "S")
+
+    def route(self, route_id):
+        code = self.route_code.get(route_id)
+        return self._add_route(route_id) if code is None else code
+
+    def coordinates(self, station):
+        # (lon, lat) like cleaning.stop_lookup_f, None for stations without coordinates
+        if station is None or self.station_lon[station] is None:
+            return None
+        return self.station_lon[station], self.station_lat[station]
+
+
+def platform_station(platform):
+    return platform >> 1
+
+
+def platform_direction(platform):
+    return DIRECTIONS[platform & 1]
+
+
+def station_complexes(codes, transfers_file="transfers.txt"):
+    # Station code -> codes of every station in its complex (itself included),
+    # the connected groups of transfers.txt
+    parent = {}
+
+    def find(station):
+        while parent.setdefault(station, station) != station:
+            parent[station] = parent[parent[station]]
+            station = parent[station]
+        return station
+
+    with open(transfers_file) as f:
+        for row in csv.DictReader(f):
+            a = codes.station_code.get(row["from_stop_id"])
+            b = codes.station_code.get(row["to_stop_id"])
+            if a is not None and b is not None:
+                parent[find(a)] = find(b)
+    groups = {}
+    for station in parent:
+        groups.setdefault(find(station), []).append(station)
+    return {station: tuple(sorted(groups[find(station)])) for station in parent}
+
+
+@functools.cache
+def load_stop_codes(stops_file="stops.txt", routes_file="routes.txt"):
+    return StopCodes(stops_file, routes_file)
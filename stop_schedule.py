@@ -1,44 +1,219 @@
-from datetime import datetime, timedelta
+import bisect
+import heapq
+import itertools
+import time
+from datetime import datetime
+from operator import itemgetter
 
+import polars as pl
 
-def stop_schedule_creation(trains_tracked, stop_schedule):
-    for trip, v in trains_tracked.items():
-        train_stops = {
-            stop[:-1]: dict(
-                direction=v["current_direction"],
-                line=v["line"],
-                arrival=times["arrival"],
-            )
-            for stop, times in v["current_schedule"].items()
+from stop_codes import load_stop_codes, platform_station
+
+BOARD_WINDOW = 30 * 60  # seconds ahead shown on a stop board
+
+_arrival_time = itemgetter(0)
+
+
+# Upcoming arrivals per station and line. Each (station, line) holds a list of
+# (arrival, trip_id, direction) kept sorted by arrival, and `trips` remembers
+# where every trip's entries are so a refreshed trip replaces its old
+# predictions instead of adding to them. Arrivals in the past are dropped by
+# `expire`; `next_arrivals` is two binary searches plus the slice it returns.
+class ArrivalIndex:
+    def __init__(self):
+        self.stops = {}  # station code -> {route code: sorted entries}
+        self.trips = {}  # trip_id -> [(station, line, entry)]
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.trips.values())
+
+    def upsert(self, trip_id, train):
+        self.remove(trip_id)
+        # One entry per station, the last stop_time wins like the feed order
+        arrivals = {platform_station(stop_time.stop): stop_time.arrival for stop_time in train.current_schedule}
+        placed = []
+        for station, arrival in arrivals.items():
+            entry = (arrival, trip_id, train.current_direction)
+            bisect.insort(self.stops.setdefault(station, {}).setdefault(train.line, []), entry)
+            placed.append((station, train.line, entry))
+        if placed:
+            self.trips[trip_id] = placed
+
+    def remove(self, trip_id):
+        for station, line, entry in self.trips.get(trip_id, ()):
+            entries = self.stops[station][line]
+            del entries[bisect.bisect_left(entries, entry)]
+            self._drop_empty(station, line)
+        self.trips.pop(trip_id, None)
+
+    def expire(self, now):
+        # Drops every arrival at or before `now`, returns how many were dropped
+        expired = 0
+        for station, lines in list(self.stops.items()):
+            for line, entries in list(lines.items()):
+                cut = bisect.bisect_right(entries, now, key=_arrival_time)
+                for entry in entries[:cut]:
+                    placed = self.trips[entry[1]]
+                    placed.remove((station, line, entry))
+                    if not placed:
+                        del self.trips[entry[1]]
+                del entries[:cut]
+                expired += cut
+                self._drop_empty(station, line)
+        return expired
+
+    def _drop_empty(self, station, line):
+        if not self.stops[station][line]:
+            del self.stops[station][line]
+            if not self.stops[station]:
+                del self.stops[station]
+
+    def lines(self, station):
+        return self.stops.get(station, {}).keys()
+
+    def next_arrivals(self, station, line, now, window=BOARD_WINDOW, limit=None):
+        # Entries arriving in (now, now + window), soonest first, at most `limit`
+        entries = self.stops.get(station, {}).get(line, [])
+        first = bisect.bisect_right(entries, now, key=_arrival_time)
+        last = bisect.bisect_left(entries, now + window, lo=first, key=_arrival_time)
+        if limit is not None:
+            last = min(last, first + limit)
+        return entries[first:last]
+
+    def board(self, station, now, window=BOARD_WINDOW):
+        # What the station's stop board shows: (line, arrival minutes) for every
+        # line with an arrival in the window, lines in board order
+        return tuple(
+            (line, tuple(arrival // 60 for arrival, _, _ in entries))
+            for line in sorted(self.lines(station))
+            if (entries := self.next_arrivals(station, line, now, window))
+        )
+
+    def upcoming(self, stations, now, lines=None, direction=None, window=BOARD_WINDOW, limit=None):
+        # next_arrivals merged over several stations and lines, soonest first, as
+        # (arrival, trip_id, direction, station, line)
+        # Each stream is built right away, a lazy one would read `station` and
+        # `line` only once heapq.merge gets to it, after the loops have moved on
+        streams = [
+            [entry + (station, line) for entry in self.next_arrivals(station, line, now, window)]
+            for station in stations
+            for line in self.lines(station)
+            if lines is None or line in lines
+        ]
+        merged = heapq.merge(*streams)
+        if direction is not None:
+            merged = (entry for entry in merged if entry[2] == direction)
+        return list(itertools.islice(merged, limit))
+
+    def snapshot(self):
+        # Copy for other threads, the same queries over tuples. `trips` is copied
+        # too so len() matches the entries. upsert, remove and expire raise on
+        # the tuples before changing anything, so a snapshot never drifts
+        frozen = ArrivalIndex()
+        frozen.stops = {
+            station: {line: tuple(entries) for line, entries in lines.items()}
+            for station, lines in self.stops.items()
         }
-        for stop, schedule in train_stops.items():
-            try:
-                stop_schedule[stop].append(schedule)
-            except KeyError:
-                # TODO: Implement logging here if stops dont seem to exist
-                # i.e. R65N
-                continue
+        frozen.trips = {trip_id: tuple(placed) for trip_id, placed in self.trips.items()}
+        return frozen
+
+
+def new_stop_schedule():
+    return ArrivalIndex()
+
+
+# With a `delta` from update_train_table only added and changed trips are
+# upserted and removed trips dropped; without one the index is rebuilt from
+# trains_tracked
+def stop_schedule_creation(trains_tracked, stop_schedule, delta=None):
+    if delta is None:
+        for trip in [t for t in stop_schedule.trips if t not in trains_tracked]:
+            stop_schedule.remove(trip)
+        trips = trains_tracked
+    else:
+        for trip in delta["removed"]:
+            stop_schedule.remove(trip)
+        trips = delta["added"] | delta["changed"]
+    for trip in trips:
+        stop_schedule.upsert(trip, trains_tracked[trip])
     return stop_schedule
 
 
 # %%
-def stop_strings_creation(stop_schedule):
+# Boards are keyed by station id string, matching the station trace names
+def stop_strings_creation(stop_schedule, codes=None, now=None):
+    codes = codes or load_stop_codes()
+    now = time.time() if now is None else now
     stop_strings = {}
-    for stop, arrivals in stop_schedule.items():
+    for station, lines in stop_schedule.stops.items():
         stop_string = ""
-        lines = set([a["line"] for a in arrivals])
         for line in sorted(lines):
-            arrivals_line = [
-                arrival
-                for arrival in arrivals
-                if arrival["line"] == line
-                and datetime.now()
-                < datetime.fromtimestamp(arrival["arrival"])
-                < datetime.now() + timedelta(minutes=30)
-            ]
-            arrivals_line_sorted = sorted(arrivals_line, key=lambda x: x["arrival"])
-            stop_string += f"<b>{line.upper()}<b><br>"
-            for arrival in arrivals_line:
-                stop_string += f"{datetime.fromtimestamp(arrival['arrival']).strftime("%I:%M")}<br>"
-            stop_strings[stop] = stop_string
+            stop_string += f"<b>{codes.route_ids[line].upper()}<b><br>"
+            for arrival, _, _ in stop_schedule.next_arrivals(station, line, now):
+                stop_string += f"{datetime.fromtimestamp(arrival).strftime('%I:%M')}<br>"
+        stop_strings[codes.station_ids[station]] = stop_string
     return stop_strings
+
+
+# Every board in one pass: all tracked schedules go into one frame, one window
+# filter runs against a single `now`, and the sorted rows are formatted with the
+# same markup as stop_strings_creation and joined per station. Lines without an
+# arrival in the window are left off their station's board.
+def stop_boards(trains_tracked, codes=None, now=None, window=BOARD_WINDOW):
+    codes = codes or load_stop_codes()
+    now = time.time() if now is None else now
+    trip, stop, line, arrival = [], [], [], []
+    for number, train in enumerate(trains_tracked.values()):
+        if train.current_schedule:
+            stops, arrivals, _ = zip(*train.current_schedule)
+            stop += stops
+            arrival += arrivals
+            trip += [number] * len(stops)
+            line += [train.line] * len(stops)
+    arrivals = pl.DataFrame(
+        {"trip": trip, "stop": stop, "line": line, "arrival": arrival},
+        schema={"trip": pl.UInt32, "stop": pl.Int64, "line": pl.Int64, "arrival": pl.Int64},
+    )
+    # Times are shown in local time like datetime.fromtimestamp, using the UTC
+    # offset at `now` for the whole window
+    utc_offset = int(datetime.fromtimestamp(now).astimezone().utcoffset().total_seconds())
+    boards = (
+        arrivals.lazy()
+        .with_columns((pl.col("stop") // 2).alias("station"))  # platform_station
+        # One arrival per trip and station, the last stop_time wins
+        .unique(["trip", "station"], keep="last", maintain_order=True)
+        .filter((pl.col("arrival") > now) & (pl.col("arrival") < now + window))
+        .sort(["station", "line", "arrival"])
+        .with_columns(
+            pl.from_epoch(pl.col("arrival") + utc_offset, time_unit="s").dt.strftime("%I:%M<br>").alias("time"),
+            # The line's header goes in front of its first arrival at the station
+            (
+                (pl.col("station") != pl.col("station").shift(1))
+                | (pl.col("line") != pl.col("line").shift(1))
+            )
+            .fill_null(True)
+            .alias("first"),
+        )
+        .select(
+            "station",
+            pl.when("first")
+            .then(
+                pl.format(
+                    "<b>{}<b><br>{}",
+                    pl.col("line").replace_strict(
+                        list(range(len(codes.route_ids))),
+                        [route_id.upper() for route_id in codes.route_ids],
+                        return_dtype=pl.String,
+                    ),
+                    pl.col("time"),
+                )
+            )
+            .otherwise(pl.col("time"))
+            .alias("board"),
+        )
+        .group_by("station", maintain_order=True)
+        .agg(pl.col("board").str.join(""))
+        .collect()
+    )
+    station_ids = codes.station_ids
+    return {station_ids[station]: board for station, board in boards.iter_rows()}
@@ -0,0 +1,49 @@
+import gtfs_realtime_pb2
+import pytest
+from google.protobuf.message import DecodeError
+
+from api_call import get_feed, header_timestamp
+
+
+def payload(timestamp):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "1.0"
+    feed.header.timestamp = timestamp
+    entity = feed.entity.add()
+    entity.id = "1"
+    entity.trip_update.trip.trip_id = "trip"
+    return feed.SerializeToString()
+
+
+def test_header_timestamp():
+    assert header_timestamp(payload(1700000000)) == 1700000000
+    assert header_timestamp(b"") is None
+
+
+def test_unchanged_snapshots_are_skipped(stub_feed):
+    stub_feed.queue((200, {"ETag": '"v1"'}, payload(100)))
+    state = {}
+    feed, _ = get_feed(stub_feed.url, state=state)
+    assert feed.header.timestamp == 100
+    assert get_feed(stub_feed.url, state=state)[0] is None
+    assert stub_feed.requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_older_snapshot_is_skipped(stub_feed):
+    state = {}
+    stub_feed.queue((200, {}, payload(100)))
+    get_feed(stub_feed.url, state=state)
+    stub_feed.queue((200, {}, payload(90)))
+    assert get_feed(stub_feed.url, state=state)[0] is None
+
+
+def test_corrupt_payload_is_fetched_again(stub_feed):
+    good = payload(100)
+    stub_feed.queue((200, {"ETag": '"v1"'}, good[:-3]), (200, {"ETag": '"v1"'}, good))
+    state = {}
+    with pytest.raises(DecodeError):
+        get_feed(stub_feed.url, state=state)
+    assert "etag" not in state and "content_hash" not in state
+    feed, _ = get_feed(stub_feed.url, state=state)
+    assert feed.header.timestamp == 100
+    assert "If-None-Match" not in stub_feed.requests[1]
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import flask
+import pytest
+
+from arrivals_api import register_arrivals_api
+from stop_schedule import ArrivalIndex
+from test_stop_schedule import train
+
+NOW = 1000
+
+
+@pytest.fixture
+def client(codes, tmp_path):
+    a09, s112 = codes.station("A09"), codes.station("112")
+    line_a, line_c, line_1 = (codes.route_code[r] for r in ("A", "C", "1"))
+    index = ArrivalIndex()
+    index.upsert("a1", train(line_a, "N", (a09, 1100)))
+    index.upsert("c1", train(line_c, "S", (a09, 1200)))
+    index.upsert("11", train(line_1, "N", (s112, 1150)))
+    worker = SimpleNamespace(current=lambda: SimpleNamespace(arrivals=index.snapshot()))
+    app = flask.Flask(__name__)
+    register_arrivals_api(app, worker, codes, clock=lambda: NOW, transfers_file=tmp_path / "transfers.txt")
+    return app.test_client()
+
+
+def arrivals(response):
+    return [(a["trip_id"], a["line"], a["station"], a["direction"]) for a in response.json["arrivals"]]
+
+
+def test_station_arrivals(client):
+    response = client.get("/api/arrivals/A09")
+    assert response.status_code == 200
+    assert response.json["stations"] == ["A09"]
+    assert arrivals(response) == [("a1", "A", "A09", "N"), ("c1", "C", "A09", "S")]
+
+
+def test_complex_merges_stations_and_lines(client):
+    response = client.get("/api/arrivals/A09?complex=1")
+    assert sorted(response.json["stations"]) == ["112", "A09"]
+    assert arrivals(response) == [
+        ("a1", "A", "A09", "N"),
+        ("11", "1", "112", "N"),
+        ("c1", "C", "A09", "S"),
+    ]
+
+
+def test_filters(client):
+    assert arrivals(client.get("/api/arrivals/A09S")) == [("c1", "C", "A09", "S")]
+    assert arrivals(client.get("/api/arrivals/A09?line=C,1")) == [("c1", "C", "A09", "S")]
+    assert arrivals(client.get("/api/arrivals/A09?limit=1")) == [("a1", "A", "A09", "N")]
+    assert arrivals(client.get("/api/arrivals/A09?window=150")) == [("a1", "A", "A09", "N")]
+
+
+@pytest.mark.parametrize("flag, stations", [("true", 2), ("Yes", 2), ("0", 1), ("false", 1)])
+def test_complex_flag(client, flag, stations):
+    assert len(client.get(f"/api/arrivals/A09?complex={flag}").json["stations"]) == stations
+
+
+def test_etag_revalidation(client):
+    etag = client.get("/api/arrivals/A09").headers["ETag"]
+    assert client.get("/api/arrivals/A09", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/arrivals/A09?limit=1", headers={"If-None-Match": etag}).status_code == 200
+
+
+@pytest.mark.parametrize(
+    "query, status",
+    [
+        ("/api/arrivals/ZZZ", 404),
+        ("/api/arrivals/A09?limit=x", 400),
+        ("/api/arrivals/A09?limit=-1", 400),
+        ("/api/arrivals/A09?window=0", 400),
+        ("/api/arrivals/A09?window=-60", 400),
+        ("/api/arrivals/A09?direction=Q", 400),
+        ("/api/arrivals/A09?direction=NS", 400),
+        ("/api/arrivals/A09?line=ZZ", 400),
+        ("/api/arrivals/A09?line=A,ZZ", 400),
+        ("/api/arrivals/A09?complex=maybe", 400),
+        ("/api/arrivals/A09?complex=", 400),
+        ("/api/arrivals/A09?limit=0", 200),
+    ],
+)
+def test_bad_requests(client, query, status):
+    assert client.get(query).status_code == status
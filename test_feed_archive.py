@@ -0,0 +1,81 @@
+import os
+
+from feed_archive import INDEX_FILE, FeedArchive, FeedRecorder, ReplaySource, list_segments, rebuild_index
+from test_api_call import payload
+
+
+def record(directory, records, segment_max_bytes=64 * 1024 * 1024):
+    recorder = FeedRecorder(directory, segment_max_bytes)
+    for feed, timestamp in records:
+        recorder.append(feed, timestamp, payload(timestamp))
+    recorder.close()
+
+
+def test_record_seek_and_replay_round_trip(tmp_path):
+    records = [("ace", 100), ("bdfm", 110), ("ace", 130), ("bdfm", 130), ("ace", 160)]
+    # A tiny segment limit spreads the records over several segments
+    record(tmp_path, records, segment_max_bytes=64)
+    assert len(list_segments(tmp_path)) > 1
+
+    archive = FeedArchive(tmp_path)
+    assert sorted(archive.feeds()) == ["ace", "bdfm"]
+    assert [(t, f) for t, f, *_ in archive.entries()] == sorted((t, f) for f, t in records)
+    for feed, timestamp in records:
+        found, location = archive.seek(feed, timestamp)
+        assert found == timestamp
+        assert archive.read(*location) == (feed, timestamp, payload(timestamp))
+        assert archive.load(*location).SerializeToString() == payload(timestamp)
+    assert archive.seek("ace", 145)[0] == 130
+    assert archive.seek("ace", 99) is None
+    archive.close()
+
+
+def test_replay_as_fast_as_possible_orders_feeds_by_header(tmp_path):
+    record(tmp_path, [("ace", 100), ("ace", 130), ("bdfm", 110), ("bdfm", 130)])
+    replay = ReplaySource(FeedArchive(tmp_path), speed=None)
+    polls = []
+    while not replay.exhausted:
+        clock = replay.clock()
+        polls.append((clock, {feed: msg.header.timestamp for feed, msg in replay.poll().items()}))
+    assert polls == [
+        (100, {"ace": 100}),
+        (110, {"bdfm": 110}),
+        (130, {"ace": 130, "bdfm": 130}),
+    ]
+    assert replay.poll() == {}
+    assert replay.clock() == 130
+
+
+def test_replay_window(tmp_path):
+    record(tmp_path, [("ace", 100), ("ace", 130), ("ace", 160)])
+    replay = ReplaySource(FeedArchive(tmp_path), speed=None, start=110, end=150)
+    assert [msg.header.timestamp for msg in replay.poll().values()] == [130]
+    assert replay.exhausted
+
+
+def test_rebuild_index_stops_at_a_truncated_tail(tmp_path):
+    record(tmp_path, [("ace", 100), ("bdfm", 110), ("ace", 130)])
+    with open(tmp_path / INDEX_FILE) as f:
+        complete = f.read()
+    segment = tmp_path / list_segments(tmp_path)[-1]
+    # Crash mid-write: the last record's payload is cut short
+    os.truncate(segment, os.path.getsize(segment) - 5)
+    rebuild_index(tmp_path)
+    with open(tmp_path / INDEX_FILE) as f:
+        assert f.read() == "".join(complete.splitlines(keepends=True)[:2])
+    archive = FeedArchive(tmp_path)
+    assert [(t, f) for t, f, *_ in archive.entries()] == [(100, "ace"), (110, "bdfm")]
+    # A torn record header is dropped the same way
+    bdfm_offset = int(complete.splitlines()[1].split("\t")[3])
+    os.truncate(segment, bdfm_offset + 3)
+    rebuild_index(tmp_path)
+    assert [(t, f) for t, f, *_ in FeedArchive(tmp_path).entries()] == [(100, "ace")]
+
+
+def test_rebuild_index_matches_the_recorded_index(tmp_path):
+    record(tmp_path, [("ace", 100), ("bdfm", 110), ("ace", 130)], segment_max_bytes=64)
+    with open(tmp_path / INDEX_FILE) as f:
+        recorded = f.read()
+    rebuild_index(tmp_path)
+    with open(tmp_path / INDEX_FILE) as f:
+        assert f.read() == recorded
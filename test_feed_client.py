@@ -0,0 +1,86 @@
+import time
+
+import pytest
+import requests
+
+import feed_client
+from feed_client import CircuitOpenError, fetch
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(feed_client, "BACKOFF_BASE", 0)
+
+
+def test_fetch_returns_response_and_latency(stub_feed):
+    stub_feed.queue((200, {}, b"payload"))
+    stats = {}
+    response, latency = fetch(stub_feed.url, stats=stats)
+    assert response.content == b"payload"
+    assert latency >= 0
+    assert stats[stub_feed.url]["failures"] == 0
+
+
+def test_fetch_retries_retryable_statuses(stub_feed):
+    stub_feed.queue((503, {}, b""), (502, {}, b""), (200, {}, b"ok"))
+    response, _ = fetch(stub_feed.url, stats={})
+    assert response.content == b"ok"
+    assert len(stub_feed.requests) == 3
+
+
+def test_fetch_does_not_retry_client_errors(stub_feed):
+    stub_feed.queue((404, {}, b""))
+    with pytest.raises(requests.HTTPError):
+        fetch(stub_feed.url, stats={})
+    assert len(stub_feed.requests) == 1
+
+
+def test_fetch_gives_up_after_retries(stub_feed):
+    stub_feed.queue((500, {}, b""))
+    with pytest.raises(requests.HTTPError):
+        fetch(stub_feed.url, retries=2, stats={})
+    assert len(stub_feed.requests) == 3
+
+
+def test_fetch_sends_headers(stub_feed):
+    fetch(stub_feed.url, stats={}, headers={"If-None-Match": '"v1"'})
+    assert stub_feed.requests[0]["If-None-Match"] == '"v1"'
+
+
+def test_breaker_opens_after_threshold(stub_feed, monkeypatch):
+    monkeypatch.setattr(feed_client, "BREAKER_THRESHOLD", 2)
+    stub_feed.queue((500, {}, b""))
+    stats = {}
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            fetch(stub_feed.url, retries=0, stats=stats)
+    with pytest.raises(CircuitOpenError):
+        fetch(stub_feed.url, stats=stats)
+    assert len(stub_feed.requests) == 2
+
+
+def test_success_closes_breaker(stub_feed):
+    stats = {stub_feed.url: {"failures": 4, "open_until": 0.0, "latency": None}}
+    fetch(stub_feed.url, stats=stats)
+    assert stats[stub_feed.url]["failures"] == 0
+
+
+def test_deadline_bounds_a_trickling_body(stub_feed):
+    # Every piece arrives well within the read timeout, the whole body does not
+    stub_feed.queue((200, {}, b"x" * 4096, 0.1))
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        fetch(stub_feed.url, stats={}, deadline=started + 0.35)
+    assert time.monotonic() - started < 0.6
+
+
+def test_deadline_allows_a_body_in_time(stub_feed):
+    stub_feed.queue((200, {}, b"x" * 4096, 0.01))
+    response, _ = fetch(stub_feed.url, stats={}, deadline=time.monotonic() + 5)
+    assert response.content == b"x" * 4096
+
+
+def test_stalled_body_times_out(stub_feed):
+    stub_feed.queue((200, {}, b"x" * 64, 1.0))
+    with pytest.raises(requests.Timeout):
+        fetch(stub_feed.url, stats={}, deadline=time.monotonic() + 0.3)
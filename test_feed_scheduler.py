@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api_call import get_feed
+from feed_scheduler import (
+    DEFAULT_CADENCE,
+    MAX_CADENCE,
+    MIN_CADENCE,
+    POLL_MARGIN,
+    RETRY_POLL,
+    FeedScheduler,
+)
+from test_api_call import payload
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_until(scheduler, done, timeout=5):
+    scheduler.start()
+    try:
+        started = time.monotonic()
+        while not done(scheduler.feed_stats()["ace"]):
+            assert time.monotonic() - started < timeout
+            time.sleep(0.01)
+    finally:
+        scheduler.stop()
+    return scheduler.feed_stats()["ace"]
+
+
+def test_slow_feed_is_reported_as_timeout(stub_feed, executor):
+    stub_feed.queue((200, {}, payload(int(time.time())) * 4, 0.2))
+    scheduler = FeedScheduler({"ace": stub_feed.url}, get_feed, executor, timeout=0.3)
+    stats = run_until(scheduler, lambda stats: stats["polls"] >= 1)
+    assert stats["status"] == "timeout"
+    assert stats["timeouts"] == 1
+    assert scheduler.snapshot() == {}
+
+
+def learned(*gaps, cadence=DEFAULT_CADENCE):
+    stats = {"cadence": cadence, "skew": None, "missed_updates": 0, "last_header_timestamp": None}
+    header = int(time.time()) - sum(gaps)
+    FeedScheduler._learn_cadence(stats, header)
+    for gap in gaps:
+        header += gap
+        FeedScheduler._learn_cadence(stats, header)
+    return stats
+
+
+def test_cadence_converges_to_header_spacing():
+    assert learned(*[15] * 30)["cadence"] == pytest.approx(15, abs=0.1)
+    assert learned(*[40] * 30)["cadence"] == pytest.approx(40, abs=0.1)
+
+
+def test_cadence_is_clamped():
+    assert learned(*[1] * 30)["cadence"] == MIN_CADENCE
+    assert learned(*[500] * 30, cadence=MAX_CADENCE)["cadence"] == MAX_CADENCE
+
+
+def test_missed_updates_are_counted_from_gaps():
+    stats = learned(15, 15, 45, 15, 60, cadence=15)
+    assert stats["missed_updates"] == 2 + 3
+    # Gaps split by the missed snapshots keep the cadence where it was
+    assert stats["cadence"] == pytest.approx(15)
+
+
+def test_repeated_or_older_headers_are_ignored():
+    stats = learned(15, 0, -30, cadence=15)
+    assert stats["cadence"] == pytest.approx(15) and stats["missed_updates"] == 0
+
+
+def test_next_poll_follows_cadence_for_a_fresh_header(stub_feed, executor):
+    stub_feed.queue((200, {}, payload(int(time.time()))))
+    scheduler = FeedScheduler({"ace": stub_feed.url}, get_feed, executor, timeout=5)
+    stats = run_until(scheduler, lambda stats: stats["version"] >= 1)
+    assert stats["skew"] == pytest.approx(0, abs=2)
+    assert stats["next_poll"] - time.monotonic() == pytest.approx(DEFAULT_CADENCE + POLL_MARGIN, abs=2)
+
+
+def test_next_poll_is_clamped_for_a_skewed_header(stub_feed, executor):
+    # A header far behind the clock would put the next poll in the past
+    stub_feed.queue((200, {}, payload(int(time.time()) - 1000)))
+    scheduler = FeedScheduler({"ace": stub_feed.url}, get_feed, executor, timeout=5)
+    stats = run_until(scheduler, lambda stats: stats["version"] >= 1)
+    assert stats["skew"] == pytest.approx(1000, abs=2)
+    assert stats["next_poll"] - time.monotonic() == pytest.approx(RETRY_POLL, abs=1)
+
+
+class CountingEvent(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self.waits = 0
+
+    def wait(self, timeout=None):
+        self.waits += 1
+        return super().wait(timeout)
+
+
+def test_idle_while_every_feed_is_in_flight(executor):
+    release = threading.Event()
+
+    def blocked_fetch(endpoint, timeout, state):
+        release.wait()
+        return None, 0.0
+
+    scheduler = FeedScheduler({"ace": "ace", "bdfm": "bdfm"}, blocked_fetch, executor, timeout=5)
+    scheduler._wake = CountingEvent()
+    scheduler.start()
+    time.sleep(1)
+    waits = scheduler._wake.waits
+    release.set()
+    scheduler.stop()
+    assert waits <= 2
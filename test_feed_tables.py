@@ -0,0 +1,48 @@
+import polars as pl
+
+from feed_tables import decode_feed, decode_feeds
+from train_table_creation import update_train_table
+from test_train_table_creation import feed
+
+TRIPS = (
+    ("a1", 2, "A03N", [("A03N", 200), ("A02N", 320)], "A"),
+    # The first update has no stop_id, the direction comes from the next one
+    ("c1", 1, "A02S", [("", 140), ("A02S", 150), ("A03S", 300)], "C"),
+    ("e1", 2, "A03N", [("", 100), ("A03N", 180)], "E"),
+)
+
+
+def test_decode_matches_the_object_path(codes):
+    message = feed(100, *TRIPS)
+    tables = decode_feed(message)
+    trains = {}
+    update_train_table(trains, {}, {"ACE": message}, codes=codes)
+
+    trips = {trip_id: (route_id, direction) for trip_id, route_id, direction in tables["trips"].iter_rows()}
+    updates = tables["stop_time_updates"].sort("trip_id", "seq", maintain_order=True)
+    vehicles = {row[0]: row for row in tables["vehicles"].iter_rows()}
+    assert set(trips) == set(trains)
+    for trip_id, train in trains.items():
+        route_id, direction = trips[trip_id]
+        assert direction == train.current_direction
+        assert codes.route_code[route_id] == train.line
+        schedule = [
+            (codes.platform(stop_id), arrival, departure)
+            for _, stop_id, _, arrival, departure in updates.filter(pl.col("trip_id") == trip_id).iter_rows()
+        ]
+        assert schedule == [tuple(stop_time) for stop_time in train.current_schedule]
+        _, stop_id, status, timestamp = vehicles[trip_id]
+        assert (status, timestamp) == (train.current_status, train.current_timestamp)
+        assert codes.station(stop_id) == train.current_station
+
+
+def test_direction_skips_empty_stop_ids():
+    trips = decode_feed(feed(100, *TRIPS))["trips"]
+    assert dict(trips.select("trip_id", "direction").iter_rows()) == {"a1": "N", "c1": "S", "e1": "N"}
+    assert decode_feed(feed(100, *TRIPS))["stop_time_updates"]["stop_id"].str.len_chars().min() > 0
+
+
+def test_decode_feeds_tags_and_stacks():
+    tables = decode_feeds({"ACE": feed(100, TRIPS[0]), "BDFM": feed(100, TRIPS[1])})
+    assert tables["trips"].select("trip_id", "feed").rows() == [("a1", "ACE"), ("c1", "BDFM")]
+    assert decode_feeds({})["vehicles"].columns == ["trip_id", "stop_id", "status", "timestamp", "feed"]
@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+
+import numpy as np
+import polars as pl
+import pytest
+
+from math_calculations import (
+    INCOMING_PROPORTION,
+    calculate_position,
+    calculate_positions,
+    cumulative_distance,
+    haversine,
+    haversine_expr,
+    haversine_np,
+    interpolate_along,
+    segment_lengths,
+)
+
+RNG = np.random.default_rng(0)
+# Points around the city, and a polyline through some of them
+LAT1, LON1, LAT2, LON2 = (RNG.uniform(*bounds, 500) for bounds in [(40.5, 40.9), (-74.1, -73.7)] * 2)
+LINE_LAT = 40.7 + np.cumsum(RNG.uniform(0, 0.002, 50))
+LINE_LON = -73.9 + np.cumsum(RNG.uniform(-0.001, 0.002, 50))
+
+
+def scalar_haversine(lat1, lon1, lat2, lon2):
+    return np.array([haversine(*point) for point in zip(lat1, lon1, lat2, lon2)])
+
+
+def test_haversine_np_matches_scalar():
+    np.testing.assert_allclose(
+        haversine_np(LAT1, LON1, LAT2, LON2), scalar_haversine(LAT1, LON1, LAT2, LON2), rtol=1e-12
+    )
+
+
+def test_haversine_expr_matches_scalar():
+    frame = pl.DataFrame({"lat1": LAT1, "lon1": LON1, "lat2": LAT2, "lon2": LON2})
+    distance = frame.select(
+        haversine_expr(pl.col("lat1"), pl.col("lon1"), pl.col("lat2"), pl.col("lon2"))
+    ).to_series()
+    np.testing.assert_allclose(distance.to_numpy(), scalar_haversine(LAT1, LON1, LAT2, LON2), rtol=1e-12)
+
+
+def test_haversine_expr_propagates_nulls():
+    frame = pl.DataFrame({"lat": [40.7, None], "lon": [-73.9, -73.9]})
+    lat, lon = pl.col("lat"), pl.col("lon")
+    distance = frame.select(haversine_expr(lat, lon, lat.shift(1), lon.shift(1))).to_series()
+    assert distance.null_count() == 2
+
+
+def test_segment_lengths_and_cumulative_distance():
+    expected = scalar_haversine(LINE_LAT[:-1], LINE_LON[:-1], LINE_LAT[1:], LINE_LON[1:])
+    lengths = segment_lengths(LINE_LAT, LINE_LON)
+    assert lengths[0] == 0
+    np.testing.assert_allclose(lengths[1:], expected, rtol=1e-9)
+    np.testing.assert_allclose(cumulative_distance(LINE_LAT, LINE_LON), np.cumsum(lengths))
+
+
+def test_interpolate_along_hits_vertices_and_ends():
+    cum_dist = cumulative_distance(LINE_LAT, LINE_LON)
+    fractions = np.concatenate(([-0.5, 0.0, 1.0, 1.5], cum_dist[1:-1] / cum_dist[-1]))
+    lon, lat = interpolate_along(LINE_LAT, LINE_LON, fractions)
+    np.testing.assert_allclose(lon[:4], [LINE_LON[0], LINE_LON[0], LINE_LON[-1], LINE_LON[-1]])
+    np.testing.assert_allclose(lat[4:], LINE_LAT[1:-1], atol=1e-12)
+    np.testing.assert_allclose(lon[4:], LINE_LON[1:-1], atol=1e-12)
+
+
+def test_interpolate_along_single_point():
+    lon, lat = interpolate_along([40.7], [-73.9], [0.0, 0.5])
+    assert lon.tolist() == [-73.9, -73.9] and lat.tolist() == [40.7, 40.7]
+
+
+@pytest.fixture
+def geometry():
+    # Two shapes laid end to end like ShapeGeometryIndex.track
+    cum_dist = cumulative_distance(LINE_LAT, LINE_LON)
+    return SimpleNamespace(
+        lat=np.concatenate((LINE_LAT, LINE_LAT[::-1])),
+        lon=np.concatenate((LINE_LON, LINE_LON[::-1])),
+        cum_dist=np.concatenate((cum_dist, cum_dist[-1] - cum_dist[::-1])),
+        track=np.concatenate((cum_dist, cum_dist[-1] + 1 + cum_dist[-1] - cum_dist[::-1])),
+    )
+
+
+def test_calculate_positions_matches_calculate_position(geometry):
+    trains = 300
+    shape = RNG.integers(0, 2, trains)
+    start = shape * 50 + RNG.integers(0, 40, trains)
+    end = start + RNG.integers(1, 50 - start % 50, trains)
+    departure = RNG.uniform(0, 100, trains)
+    arrival = departure + RNG.choice([0, 60, 120], trains)
+    api_time = departure + RNG.uniform(-30, 150, trains)
+    incoming = RNG.random(trains) < 0.2
+
+    lon, lat = calculate_positions(geometry, start, end, departure, arrival, api_time, incoming)
+    expected = np.array(
+        [
+            calculate_position(*train, geometry, s, e, i)
+            for train, s, e, i in zip(zip(api_time, departure, arrival), start, end, incoming)
+        ]
+    )
+    np.testing.assert_allclose(lon, expected[:, 0], atol=1e-9)
+    np.testing.assert_allclose(lat, expected[:, 1], atol=1e-9)
+
+
+def test_calculate_positions_stopped_and_incoming(geometry):
+    lon, lat = calculate_positions(
+        geometry, [3, 3], [10, 10], [0, 0], [100, 100], [50, 50], [False, True], [True, False]
+    )
+    assert (lon[0], lat[0]) == (geometry.lon[3], geometry.lat[3])
+    np.testing.assert_allclose(
+        (lon[1], lat[1]), calculate_position(50, 0, 100, geometry, 3, 10, incoming=True), atol=1e-12
+    )
+    # Incoming ignores the timetable: the same point as INCOMING_PROPORTION of the trip time
+    np.testing.assert_allclose(
+        (lon[1], lat[1]), calculate_position(INCOMING_PROPORTION * 100, 0, 100, geometry, 3, 10), atol=1e-12
+    )
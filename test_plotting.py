@@ -0,0 +1,80 @@
+from ingest import EMPTY_SNAPSHOT
+from plotting import STATIONS_TRACE, StopBoardCache, trains_trace
+from stop_schedule import ArrivalIndex, stop_strings_creation
+from test_stop_schedule import train
+
+
+def figure():
+    return {
+        "data": [
+            {"name": "lines"},
+            {"name": STATIONS_TRACE, "customdata": ["A02", "A03", "Z99"], "hovertext": ["a", "b", "c"]},
+        ]
+    }
+
+
+def snapshot(version, codes, clock, *trains):
+    # trains are (trip_id, line, (station id, arrival)...)
+    index = ArrivalIndex()
+    for trip_id, line, *stops in trains:
+        index.upsert(trip_id, train(line, "N", *((codes.station_code[s], a) for s, a in stops)))
+    return EMPTY_SNAPSHOT._replace(
+        version=version,
+        clock=clock,
+        arrivals=index.snapshot(),
+        stop_strings=stop_strings_creation(index, codes, clock),
+    )
+
+
+def test_render_only_touches_changed_boards(codes):
+    fig_json = figure()
+    cache = StopBoardCache(fig_json, codes)
+    hovertext = fig_json["data"][1]["hovertext"]
+    first = snapshot(1, codes, 0, ("t1", 0, ("A02", 600), ("A03", 700)), ("t2", 1, ("A09", 600)))
+    assert sorted(cache.render(first)) == ["A02", "A03"]
+    assert hovertext[0] == f"a<br>{first.stop_strings['A02']}" and hovertext[2] == "c"
+    # Seconds that do not move a minute label leave the board alone
+    assert cache.render(snapshot(2, codes, 0, ("t1", 0, ("A02", 610), ("A03", 700)))) == []
+    assert (cache.last_hits, cache.last_misses) == (2, 0)
+    # A board that drops off is reset to the station title
+    assert cache.render(snapshot(3, codes, 0, ("t1", 0, ("A02", 610)))) == ["A03"]
+    assert hovertext[:2] == [f"a<br>{first.stop_strings['A02']}", "b"]
+    # As does one whose arrivals leave the window
+    assert cache.render(snapshot(4, codes, 3000, ("t1", 0, ("A02", 610)))) == ["A02"]
+    assert hovertext == ["a", "b", "c"]
+
+
+def test_each_snapshot_is_rendered_once(codes):
+    cache = StopBoardCache(figure(), codes)
+    first = snapshot(1, codes, 0, ("t1", 0, ("A02", 600)))
+    assert cache.render(first) == ["A02"]
+    assert cache.render(first) is None
+    assert cache.stats() == {
+        "version": 1,
+        "snapshot": 1,
+        "hits": 0,
+        "misses": 1,
+        "last_hits": 0,
+        "last_misses": 1,
+        "boards": 1,
+    }
+
+
+def test_changes_since_serves_each_client_what_it_missed(codes):
+    cache = StopBoardCache(figure(), codes)
+    cache.render(snapshot(1, codes, 0, ("t1", 0, ("A02", 600), ("A03", 700))))
+    last = snapshot(2, codes, 0, ("t1", 0, ("A02", 600), ("A03", 760)))
+    cache.render(last)
+    cache.render(snapshot(3, codes, 0, ("t1", 0, ("A02", 600), ("A03", 770))))
+    assert cache.version == 2
+    assert cache.changes_since(0) == {0: f"a<br>{last.stop_strings['A02']}", 1: f"b<br>{last.stop_strings['A03']}"}
+    assert cache.changes_since(1) == {1: f"b<br>{last.stop_strings['A03']}"}
+    assert cache.changes_since(2) == {}
+
+
+def test_trains_trace_is_one_trace_for_the_fleet():
+    trace = trains_trace([("t1", (-73.9, 40.7), "A"), ("t2", (-73.8, 40.8), "1")], {"A": "#0039A6", "1": "#EE352E"})
+    assert trace["customdata"] == ["t1", "t2"]
+    assert trace["lon"] == [-73.9, -73.8] and trace["lat"] == [40.7, 40.8]
+    assert trace["marker"]["color"] == ["#0039A6", "#EE352E"]
+    assert trains_trace([], {})["lon"] == []
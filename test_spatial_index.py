@@ -0,0 +1,74 @@
+import numpy as np
+import polars as pl
+
+from spatial_index import GridIndex, project, snap_stops_to_shapes
+
+RNG = np.random.default_rng(0)
+LON = RNG.uniform(-74.0, -73.9, 2000)
+LAT = RNG.uniform(40.7, 40.8, 2000)
+
+
+def brute_distances(lon, lat):
+    x, y = project(LON, LAT)
+    qx, qy = project(lon, lat)
+    return np.hypot(x - qx, y - qy)
+
+
+def test_radius_matches_brute_force():
+    index = GridIndex(LON, LAT, cell_size=150)
+    for lon, lat in zip(LON[:20], LAT[:20]):
+        found, distances = index.radius(lon, lat, 400)
+        brute = brute_distances(lon, lat)
+        assert set(found.tolist()) == set(np.flatnonzero(brute <= 400).tolist())
+        assert np.all(np.diff(distances) >= 0)
+        np.testing.assert_allclose(distances, brute[found])
+
+
+def test_bbox_and_nearest():
+    index = GridIndex(LON, LAT)
+    inside = (LON >= -73.97) & (LON <= -73.95) & (LAT >= 40.72) & (LAT <= 40.75)
+    assert index.bbox(-73.97, 40.72, -73.95, 40.75).tolist() == np.flatnonzero(inside).tolist()
+    point, distance = index.nearest(-73.95, 40.75, 1000)
+    assert point == int(np.argmin(brute_distances(-73.95, 40.75)))
+    assert index.nearest(-80, 40, 1000) is None
+
+
+def shape(shape_id, lats):
+    return pl.DataFrame(
+        {
+            "shape_id": shape_id,
+            "shape_pt_sequence": list(range(len(lats))),
+            "shape_pt_lat": lats,
+            "shape_pt_lon": -73.9412,
+        }
+    )
+
+
+def test_stations_sharing_a_point_snap_to_every_shape():
+    # A and D shapes both pass 145 St, where A12 and D13 share coordinates
+    lats = [40.8230, 40.8240, 40.8249, 40.8260]
+    shapes = pl.concat([shape("A..N55R", lats), shape("D..N05R", lats)])
+    stops = pl.DataFrame(
+        {
+            "stop_name": ["145 St", "145 St", "155 St"],
+            "stop_id": ["A12", "D13", "D12"],
+            "stop_lat": [40.824783, 40.824783, 40.8300],
+            "stop_lon": [-73.9412, -73.9412, -73.9412],
+        }
+    )
+    snapped = snap_stops_to_shapes(shapes, stops).drop_nulls("stop_id")
+    assert sorted(snapped.select("shape_id", "stop_id").iter_rows()) == [
+        ("A..N55R", "A12"),
+        ("A..N55R", "D13"),
+        ("D..N05R", "A12"),
+        ("D..N05R", "D13"),
+    ]
+    # Each stop lands on the nearest vertex of the shape
+    assert snapped["shape_pt_sequence"].to_list() == [2, 2, 2, 2]
+
+
+def test_unsnapped_vertices_keep_null_stops():
+    shapes = shape("A..N55R", [40.80, 40.81])
+    stops = pl.DataFrame({"stop_name": ["x"], "stop_id": ["A01"], "stop_lat": [40.9], "stop_lon": [-73.9412]})
+    snapped = snap_stops_to_shapes(shapes, stops)
+    assert snapped.height == 2 and snapped["stop_id"].null_count() == 2
@@ -0,0 +1,25 @@
+from stop_codes import platform_direction, platform_station
+
+
+def test_platform_codes_round_trip(codes):
+    station = codes.station("A03")
+    assert codes.station("A03N") == codes.station("A03S") == station
+    assert platform_station(codes.platform("A03S")) == station
+    assert platform_direction(codes.platform("A03N")) == "N"
+    assert platform_direction(codes.platform("A03S")) == "S"
+
+
+def test_unknown_stops_get_new_codes(codes):
+    station = codes.station("R60N")
+    assert codes.station_ids[station] == "R60"
+    assert codes.station("R60") == station
+    assert codes.coordinates(station) is None
+
+
+def test_empty_stop_id_mints_no_station(codes):
+    stations = len(codes.station_ids)
+    assert codes.station("") is None
+    assert codes.platform("") is None
+    assert codes.coordinates(None) is None
+    assert len(codes.station_ids) == stations
+    assert "" not in codes.station_ids
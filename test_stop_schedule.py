@@ -0,0 +1,76 @@
+import pytest
+
+from stop_schedule import ArrivalIndex
+from train_state import StopTime, TrainState
+
+
+def train(line, direction, *stops):
+    # stops are (station, arrival), stored as platforms of `direction`
+    bit = direction == "S"
+    schedule = tuple(StopTime(station << 1 | bit, arrival, arrival) for station, arrival in stops)
+    return TrainState(None, None, None, None, schedule, 2, 0, direction, line)
+
+
+def test_upsert_replaces_a_trips_predictions():
+    index = ArrivalIndex()
+    index.upsert("a", train(3, "N", (10, 1000), (11, 1100)))
+    index.upsert("a", train(3, "N", (10, 1050)))
+    assert index.next_arrivals(10, 3, now=0) == [(1050, "a", "N")]
+    assert index.next_arrivals(11, 3, now=0) == []
+    assert len(index) == 1
+
+
+def test_next_arrivals_window_and_expire():
+    index = ArrivalIndex()
+    index.upsert("a", train(3, "N", (10, 1000)))
+    index.upsert("b", train(3, "N", (10, 2000)))
+    index.upsert("c", train(3, "N", (10, 5000)))
+    assert [e[1] for e in index.next_arrivals(10, 3, now=900, window=1800)] == ["a", "b"]
+    assert [e[1] for e in index.next_arrivals(10, 3, now=900, window=1800, limit=1)] == ["a"]
+    assert index.expire(1500) == 1
+    assert "a" not in index.trips
+    assert [e[1] for e in index.next_arrivals(10, 3, now=0, window=10_000)] == ["b", "c"]
+    index.remove("b")
+    index.remove("c")
+    assert index.stops == {} and index.trips == {}
+
+
+def test_upcoming_labels_every_station_and_line():
+    index = ArrivalIndex()
+    index.upsert("a", train(3, "N", (10, 1000)))
+    index.upsert("b", train(7, "S", (11, 1100)))
+    index.upsert("c", train(7, "N", (10, 1200)))
+    index.upsert("d", train(3, "S", (11, 1300)))
+    assert index.upcoming([10, 11], now=0) == [
+        (1000, "a", "N", 10, 3),
+        (1100, "b", "S", 11, 7),
+        (1200, "c", "N", 10, 7),
+        (1300, "d", "S", 11, 3),
+    ]
+    assert index.upcoming([10, 11], now=0, lines={7}) == [(1100, "b", "S", 11, 7), (1200, "c", "N", 10, 7)]
+    assert index.upcoming([10, 11], now=0, direction="S", limit=1) == [(1100, "b", "S", 11, 7)]
+    assert index.upcoming([10, 11], now=1150, window=100) == [(1200, "c", "N", 10, 7)]
+
+
+def test_snapshot_is_frozen():
+    index = ArrivalIndex()
+    index.upsert("a", train(3, "N", (10, 1000)))
+    frozen = index.snapshot()
+    index.upsert("b", train(3, "N", (10, 900)))
+    assert frozen.upcoming([10], now=0) == [(1000, "a", "N", 10, 3)]
+    assert len(frozen) == 1 and set(frozen.trips) == {"a"}
+    with pytest.raises(TypeError):
+        frozen.remove("a")
+    with pytest.raises(TypeError):
+        frozen.upsert("a", train(3, "N", (10, 1100)))
+    assert len(frozen) == 1 and frozen.upcoming([10], now=0) == [(1000, "a", "N", 10, 3)]
+
+
+def test_board_is_the_visible_minutes_per_line():
+    index = ArrivalIndex()
+    index.upsert("a", train(3, "N", (10, 1000)))
+    index.upsert("b", train(1, "S", (10, 1030)))
+    index.upsert("c", train(3, "N", (10, 5000)))
+    assert index.board(10, now=900) == ((1, (17,)), (3, (16,)))
+    assert index.board(10, now=1010) == ((1, (17,)),)
+    assert index.board(11, now=0) == ()
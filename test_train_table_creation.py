@@ -0,0 +1,98 @@
+import gtfs_realtime_pb2
+
+from train_table_creation import update_train_table
+
+
+def feed(timestamp, *trips):
+    # trips are (trip_id, vehicle status, vehicle stop_id, [(stop_id, arrival)], route_id)
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = "1.0"
+    message.header.timestamp = timestamp
+    for trip_id, status, stop_id, stops, route_id in trips:
+        entity = message.entity.add()
+        entity.id = f"{trip_id}-update"
+        entity.trip_update.trip.trip_id = trip_id
+        entity.trip_update.trip.route_id = route_id
+        for stop, arrival in stops:
+            update = entity.trip_update.stop_time_update.add()
+            update.stop_id = stop
+            update.arrival.time = arrival
+            update.departure.time = arrival
+        entity = message.entity.add()
+        entity.id = f"{trip_id}-vehicle"
+        entity.vehicle.trip.trip_id = trip_id
+        entity.vehicle.current_status = status
+        entity.vehicle.stop_id = stop_id
+        entity.vehicle.timestamp = timestamp
+    return message
+
+
+def a1(arrival=200):
+    return ("a1", 2, "A03N", [("A03N", arrival), ("A02N", arrival + 120)], "A")
+
+
+def c1():
+    return ("c1", 1, "A02S", [("A02S", 150), ("A03S", 300)], "C")
+
+
+def test_first_batch_adds_every_trip(codes):
+    trains, problems = {}, {}
+    delta = update_train_table(trains, problems, {"ACE": feed(100, a1(), c1())}, codes=codes)
+    assert delta == {"added": {"a1", "c1"}, "changed": set(), "removed": set()}
+    assert trains["a1"].planned_next_station == codes.station("A03")
+    assert trains["c1"].current_station == codes.station("A02")
+    assert trains["c1"].current_direction == "S"
+
+
+def test_unchanged_trips_produce_no_delta(codes):
+    trains, problems = {}, {}
+    update_train_table(trains, problems, {"ACE": feed(100, a1(), c1())}, codes=codes)
+    before = {trip_id: train.fingerprint for trip_id, train in trains.items()}
+    delta = update_train_table(trains, problems, {"ACE": feed(100, a1(), c1())}, codes=codes)
+    assert delta == {"added": set(), "changed": set(), "removed": set()}
+    assert {trip_id: train.fingerprint for trip_id, train in trains.items()} == before
+
+
+def test_changed_trip_is_classified_by_fingerprint(codes):
+    trains, problems = {}, {}
+    update_train_table(trains, problems, {"ACE": feed(100, a1(), c1())}, codes=codes)
+    delta = update_train_table(trains, problems, {"ACE": feed(100, a1(arrival=230), c1())}, codes=codes)
+    assert delta == {"added": set(), "changed": {"a1"}, "removed": set()}
+    assert trains["a1"].current_schedule[0].arrival == 230
+
+
+def test_trip_missing_from_its_feed_is_removed(codes):
+    trains, problems = {}, {}
+    update_train_table(trains, problems, {"ACE": feed(100, a1(), c1())}, codes=codes)
+    delta = update_train_table(trains, problems, {"ACE": feed(130, a1())}, codes=codes)
+    assert delta["removed"] == {"c1"}
+    assert set(trains) == {"a1"}
+
+
+def test_other_feeds_do_not_evict(codes):
+    trains, problems = {}, {}
+    update_train_table(trains, problems, {"ACE": feed(100, a1(), c1())}, codes=codes)
+    delta = update_train_table(trains, problems, {"BDFM": feed(130)}, codes=codes)
+    assert delta["removed"] == set()
+    assert set(trains) == {"a1", "c1"}
+
+
+def test_ttl_evicts_against_the_batch_header_time(codes):
+    trains, problems = {}, {}
+    update_train_table(trains, problems, {"ACE": feed(100, a1(), c1())}, codes=codes)
+    # Another feed moves the batch clock: within the TTL nothing goes
+    delta = update_train_table(trains, problems, {"BDFM": feed(150)}, ttl=60, codes=codes)
+    assert delta["removed"] == set()
+    delta = update_train_table(trains, problems, {"BDFM": feed(161)}, ttl=60, codes=codes)
+    assert delta == {"added": set(), "changed": set(), "removed": {"a1", "c1"}}
+    assert trains == {}
+
+
+def test_trips_without_stop_updates_are_logged(codes):
+    trains, problems = {}, {}
+    update_train_table(trains, problems, {"ACE": feed(100, ("x1", 1, "A02N", [("", 150)], "A"))}, codes=codes)
+    assert trains == {}
+    assert problems["x1"]["reason"] == "Updates"
+    # And dropped from the log once their feed stops listing them
+    update_train_table(trains, problems, {"ACE": feed(130)}, codes=codes)
+    assert problems == {}
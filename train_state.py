@@ -0,0 +1,70 @@
+from typing import NamedTuple
+
+
+class StopTime(NamedTuple):
+    stop: int  # platform code, see stop_codes
+    arrival: int
+    departure: int
+
+
+def schedule_from_updates(updates, codes):
+    # The one schedule representation used everywhere: a tuple of StopTime in
+    # feed order, with stops encoded as platform codes. Updates without a stop_id
+    # are left out.
+    platform = codes.platform
+    return tuple(
+        StopTime(platform(u.stop_id), u.arrival.time, u.departure.time) for u in updates if u.stop_id
+    )
+
+
+# Stations are station codes and `line` is a route code from stop_codes
+class TrainState:
+    __slots__ = (
+        "prev_departure_time",
+        "prev_departure_station",
+        "planned_next_station",
+        "current_station",
+        "current_schedule",
+        "current_status",
+        "current_timestamp",
+        "current_direction",
+        "line",
+        "feed",
+        "fingerprint",
+        "last_seen",
+    )
+
+    def __init__(
+        self,
+        prev_departure_time,
+        prev_departure_station,
+        planned_next_station,
+        current_station,
+        current_schedule,
+        current_status,
+        current_timestamp,
+        current_direction,
+        line,
+        feed=None,
+        fingerprint=None,
+        last_seen=None,
+    ):
+        self.prev_departure_time = prev_departure_time
+        self.prev_departure_station = prev_departure_station
+        self.planned_next_station = planned_next_station
+        self.current_station = current_station
+        self.current_schedule = current_schedule
+        self.current_status = current_status
+        self.current_timestamp = current_timestamp
+        self.current_direction = current_direction
+        self.line = line
+        self.feed = feed
+        self.fingerprint = fingerprint
+        self.last_seen = last_seen
+
+    def copy(self):
+        return TrainState(*(getattr(self, slot) for slot in self.__slots__))
+
+    def __repr__(self):
+        fields = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__)
+        return f"TrainState({fields})"
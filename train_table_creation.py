@@ -1,5 +1,7 @@
 from api_call import get_base_data
-import re
+import time
+from stop_codes import load_stop_codes, platform_direction, platform_station
+from train_state import TrainState, schedule_from_updates
 
 API_ENDPOINTS = {
     "ACE": r"https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-ace",
@@ -12,122 +14,152 @@ API_ENDPOINTS = {
     "SI": r"https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-si",
 }
 
+TRAIN_TTL = 15 * 60  # seconds a trip may go unreported before it is evicted
 
-def departure_time(updates):
+
+def departure_time(schedule):
     try:
-        return updates[0][0].departure.time
+        return schedule[0].departure
     except IndexError:
         return None
 
 
-def get_stop(updates):
+def get_stop(schedule):
     try:
-        return updates[0][0].stop_id
+        return platform_station(schedule[0].stop)
     except IndexError:
         return None
 
 
-# %%
-def initialize_train_table(trains_tracked, last_updated, problems_log):
-    data = get_base_data(API_ENDPOINTS, last_updated)
-    for feed in data.values():
-        for trip_id in set(
-            [x.vehicle.trip.trip_id for x in feed.entity if x.vehicle.trip.trip_id]
-        ):
-
-            vehicle = [
-                x.vehicle
-                for x in feed.entity
-                if x.HasField("vehicle") and x.vehicle.trip.trip_id == trip_id
-            ]
-            updates = [
-                x.trip_update.stop_time_update
-                for x in feed.entity
-                if x.HasField("trip_update") and x.trip_update.trip.trip_id == trip_id
-            ]
-            trip_details = [
-                x.trip_update.trip
-                for x in feed.entity
-                if x.HasField("trip_update") and x.trip_update.trip.trip_id == trip_id
-            ]
+# Walks the feed once and groups its entities by trip_id, so the per-trip logic
+# below is a dict lookup instead of a scan over every entity
+def index_feed(feed):
+    index = {}
+    for entity in feed.entity:
+        if entity.HasField("vehicle") and entity.vehicle.trip.trip_id:
+            index.setdefault(entity.vehicle.trip.trip_id, [None, None])[0] = entity.vehicle
+        if entity.HasField("trip_update") and entity.trip_update.trip.trip_id:
+            index.setdefault(entity.trip_update.trip.trip_id, [None, None])[1] = entity.trip_update
+    return index
 
-            # Avoids trains with missing information
-            if len(vehicle) == 0 and len(updates[0]) == 0:
-                problems_log[trip_id] = "Both"
-                continue
-            elif len(vehicle) == 0:
-                problems_log[trip_id] = "Vehicle"
+
+def new_delta():
+    return {"added": set(), "changed": set(), "removed": set()}
+
+
+def _fingerprint(vehicle, trip_update):
+    return hash((vehicle.SerializeToString(), trip_update.SerializeToString()))
+
+
+def _evict(tracked, trip_ids, delta=None):
+    for trip_id in trip_ids:
+        del tracked[trip_id]
+        if delta is not None:
+            delta["added"].discard(trip_id)
+            delta["changed"].discard(trip_id)
+            delta["removed"].add(trip_id)
+
+
+# Applies the feeds in `data` to `trains_tracked` and returns the delta as sets
+# of added, changed and removed trip_ids. Trips whose vehicle and trip_update are
+# byte-identical to the last cycle are left untouched. A trip is evicted once the
+# feed that reported it no longer does, or once nothing has reported it for `ttl`
+# seconds, so trains_tracked and problems_log stay bounded over long runs.
+def update_train_table(trains_tracked, problems_log, data, ttl=TRAIN_TTL, codes=None):
+    codes = codes or load_stop_codes()
+    delta = new_delta()
+    now = None
+    for feed_name, feed in data.items():
+        seen_at = feed.header.timestamp or int(time.time())
+        now = max(now or seen_at, seen_at)
+        index = index_feed(feed)
+        for trip_id, (vehicle, trip_update) in index.items():
+            # Only trains reporting a position are tracked
+            if vehicle is None:
                 continue
-            elif len(updates[0]) == 0:
-                problems_log[trip_id] = "Updates"
+
+            # Avoids trains with missing information
+            if trip_update is None or not any(u.stop_id for u in trip_update.stop_time_update):
+                problems_log[trip_id] = {"reason": "Updates", "feed": feed_name, "last_seen": seen_at}
                 continue
+            problems_log.pop(trip_id, None)
 
-            vehicle = vehicle[0]
-            updates = updates[0]
-            trip_details = trip_details[0]
+            fingerprint = _fingerprint(vehicle, trip_update)
+            if trip_id in trains_tracked and trains_tracked[trip_id].fingerprint == fingerprint:
+                trains_tracked[trip_id].last_seen = seen_at
+                continue
+            delta["changed" if trip_id in trains_tracked else "added"].add(trip_id)
 
-            updates_dict = {
-                x.stop_id: {"arrival": x.arrival.time, "departure": x.departure.time}
-                for x in updates
-            }
+            schedule = schedule_from_updates(trip_update.stop_time_update, codes)
+            line = codes.route(trip_update.trip.route_id)
             current_status = vehicle.current_status
             current_timestamp = vehicle.timestamp
-            current_stop = vehicle.stop_id
-            number_stop = re.compile(r"^(\w+)([NS]{1})")
-            current_stop = number_stop.match(current_stop).groups(1)[0]
+            current_stop = codes.station(vehicle.stop_id)
+            current_direction = platform_direction(schedule[0].stop)
             if current_status == 1:
-                if len(updates_dict) == 1:
-                    trains_tracked[trip_id] = {
-                        "prev_departure_time": current_timestamp,
-                        "prev_departure_station": current_stop,
-                        "planned_next_station": None,
-                        "current_station": current_stop,
-                        "current_schedule": updates_dict,
-                        "current_status": current_status,
-                        "current_timestamp": current_timestamp,
-                        "current_direction": list(updates_dict.keys())[0][-1],
-                        "line": trip_details.route_id,
-                    }
-                else:
-                    trains_tracked[trip_id] = {
-                        "prev_departure_time": current_timestamp,
-                        "prev_departure_station": current_stop,
-                        "planned_next_station": number_stop.match(
-                            list(updates_dict.keys())[1]
-                        ).groups(1)[0],
-                        "current_station": current_stop,
-                        "current_schedule": updates_dict,
-                        "current_status": current_status,
-                        "current_timestamp": current_timestamp,
-                        "current_direction": list(updates_dict.keys())[0][-1],
-                        "line": trip_details.route_id,
-                    }
+                trains_tracked[trip_id] = TrainState(
+                    prev_departure_time=current_timestamp,
+                    prev_departure_station=current_stop,
+                    planned_next_station=platform_station(schedule[1].stop) if len(schedule) > 1 else None,
+                    current_station=current_stop,
+                    current_schedule=schedule,
+                    current_status=current_status,
+                    current_timestamp=current_timestamp,
+                    current_direction=current_direction,
+                    line=line,
+                )
             elif current_status in (0, 2):
                 # TODO: Implement if previous stop is not found, symbol appears red if previosly plotted
                 if (
                     trip_id not in trains_tracked
-                    or trains_tracked[trip_id]["planned_next_station"] != current_stop
+                    or trains_tracked[trip_id].planned_next_station != current_stop
                 ):
-                    trains_tracked[trip_id] = {
-                        "prev_departure_time": None,
-                        "prev_departure_station": None,
-                        "planned_next_station": current_stop,
-                        "current_station": current_stop,
-                        "current_schedule": updates_dict,
-                        "current_status": current_status,
-                        "current_timestamp": current_timestamp,
-                        "current_direction": list(updates_dict.keys())[0][-1],
-                        "line": trip_details.route_id,
-                    }
+                    trains_tracked[trip_id] = TrainState(
+                        prev_departure_time=None,
+                        prev_departure_station=None,
+                        planned_next_station=current_stop,
+                        current_station=current_stop,
+                        current_schedule=schedule,
+                        current_status=current_status,
+                        current_timestamp=current_timestamp,
+                        current_direction=current_direction,
+                        line=line,
+                    )
                 else:
-                    trains_tracked[trip_id]["current_timestamp"] = current_timestamp
-                    trains_tracked[trip_id]["current_station"] = None
+                    trains_tracked[trip_id].current_timestamp = current_timestamp
+                    trains_tracked[trip_id].current_status = current_status
+                    trains_tracked[trip_id].current_schedule = schedule
+                    trains_tracked[trip_id].current_station = None
             else:
-                if get_stop(updates) != trains_tracked[trip_id]["planned_next_station"]:
-                    trains_tracked[trip_id]["prev_departure_station"] = trains_tracked[
-                        trip_id
-                    ]["next_station"]
-                    trains_tracked[trip_id]["next_station"] = get_stop(updates)
-                trains_tracked[trip_id]["current_schedule"] = updates
+                train = trains_tracked[trip_id]
+                if get_stop(schedule) != train.planned_next_station:
+                    train.prev_departure_station = train.planned_next_station
+                    train.planned_next_station = get_stop(schedule)
+                train.current_schedule = schedule
 
+            trains_tracked[trip_id].feed = feed_name
+            trains_tracked[trip_id].fingerprint = fingerprint
+            trains_tracked[trip_id].last_seen = seen_at
+
+        _evict(
+            trains_tracked,
+            [t for t, v in trains_tracked.items() if v.feed == feed_name and t not in index],
+            delta,
+        )
+        _evict(
+            problems_log,
+            [t for t, v in problems_log.items() if v["feed"] == feed_name and t not in index],
+        )
+
+    if now is not None:
+        _evict(trains_tracked, [t for t, v in trains_tracked.items() if now - v.last_seen > ttl], delta)
+        _evict(problems_log, [t for t, v in problems_log.items() if now - v["last_seen"] > ttl])
+    return delta
+
+
+# %%
+def initialize_train_table(trains_tracked, last_updated, problems_log, data=None):
+    if data is None:
+        data = get_base_data(API_ENDPOINTS, last_updated)
+    last_updated["delta"] = update_train_table(trains_tracked, problems_log, data)
     return trains_tracked
@@ -0,0 +1,76 @@
+import re
+from collections import Counter
+
+import polars as pl
+
+# "000600_1..S" out of a realtime trip_id, used when the shape variant is missing
+SIMPLE_ROUTE = re.compile(r"^.*_(.*?\.{1,2}[NS]).*")
+
+
+def normalize_trip_id(trip_id):
+    # Static trip_ids carry a schedule prefix ("AFA23GEN-1038-Sunday-00_000600_1..S03R"),
+    # realtime ones start at the origin time ("000600_1..S03R")
+    head, _, tail = trip_id.partition("_")
+    return tail if "-" in head else trip_id
+
+
+# (trip_id, shape_id) from trips.txt for every trip on a known shape, trip_ids
+# normalized to their realtime form. Only trip_id and shape_id are read, and
+# unknown shapes never leave the scan.
+def trip_shape_table(shape_ids, trips_file="trips.txt"):
+    return (
+        pl.scan_csv(
+            trips_file,
+            schema_overrides={"trip_id": pl.String, "shape_id": pl.String},
+        )
+        .select(["trip_id", "shape_id"])
+        .drop_nulls("shape_id")
+        .filter(pl.col("shape_id").is_in(list(shape_ids)))
+        .collect(engine="streaming")
+        # normalize_trip_id as a native regex: drop a leading "...-..._" schedule prefix
+        .with_columns(pl.col("trip_id").str.replace(r"^[^_]*-[^_]*_", ""))
+        .unique("trip_id", keep="first", maintain_order=True)
+    )
+
+
+# Resolves realtime trip_ids to shape_ids in O(1): first through the trips.txt
+# index on the normalized trip_id, then through a shape_id embedded in the trip_id,
+# and last through a memoized table of route/direction patterns. `counts` records
+# how often each path was taken, `stats` reports them. `trips` is a
+# trip_shape_table, e.g. read back from the static bundle.
+class TripShapeIndex:
+    def __init__(self, shape_ids, trips_file="trips.txt", trips=None):
+        self.shape_ids = set(shape_ids)
+        trips = trip_shape_table(self.shape_ids, trips_file) if trips is None else trips
+        self.by_trip = dict(trips.select(["trip_id", "shape_id"]).iter_rows())
+        self.patterns = {}
+        self.counts = Counter()
+
+    def _match_pattern(self, pattern):
+        if pattern not in self.patterns:
+            pattern_x = pattern.replace("X", "")
+            self.patterns[pattern] = next(
+                (s for s in sorted(self.shape_ids) if pattern in s or pattern_x in s), None
+            )
+        return self.patterns[pattern]
+
+    def resolve(self, trip_id):
+        if shape_id := self.by_trip.get(trip_id):
+            self.counts["trips_index"] += 1
+            return shape_id
+        suffix = trip_id.rpartition("_")[2]
+        if suffix in self.shape_ids:
+            self.counts["trip_id_shape"] += 1
+            return suffix
+        if (match := SIMPLE_ROUTE.match(trip_id)) and (shape_id := self._match_pattern(match.group(1))):
+            self.counts["pattern"] += 1
+            return shape_id
+        self.counts["unmatched"] += 1
+        return None
+
+    def stats(self):
+        return {
+            "resolved": dict(self.counts),
+            "trips_indexed": len(self.by_trip),
+            "patterns_memoized": len(self.patterns),
+        }